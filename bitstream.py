@@ -0,0 +1,163 @@
+import numpy as np
+from types import MappingProxyType
+
+# Packed bit input/output for the entropy coded stream.
+# Fields are (code, length) integer pairs written MSB first. Runs of fields
+# are expanded to bits and packed with numpy in one go, and every 0xFF byte
+# that reaches the buffer is followed by a stuffed 0x00 as in a jpeg scan.
+# Reading peeks a fixed number of bits and resolves huffman codes through
+# lookup tables rather than matching codewords one bit at a time.
+
+def stuffBytes(data):
+    # insert 0x00 after every 0xFF so the stream can't be mistaken for a marker
+    data = np.frombuffer(bytes(data), dtype=np.uint8)
+    return np.insert(data, np.flatnonzero(data == 0xFF) + 1, 0).tobytes()
+
+def unstuffBytes(data):
+    # drop the 0x00 that follows every 0xFF
+    data = np.frombuffer(bytes(data), dtype=np.uint8)
+    stuffed = np.flatnonzero(data[:-1] == 0xFF) + 1
+    return np.delete(data, stuffed).tobytes()
+
+# fields expanded to bits per step in bitwriter.writeFields
+FIELD_CHUNK = 1 << 16
+
+class bitwriter:
+    def __init__(self):
+        self.buffer = bytearray()
+        # bits that don't fill a whole byte yet, carried into the next write
+        self.pending = np.zeros(0, dtype=np.uint8)
+        self.bit_count = 0
+
+    def __len__(self):
+        # number of bits written so far, not counting stuffing or padding
+        return self.bit_count
+
+    def write(self, code, length):
+        self.writeFields([code], [length])
+
+    def writeFields(self, codes, lengths):
+        # write every codes[i] as a lengths[i]-bit field, in order.
+        # long runs are expanded a chunk at a time to bound the bit arrays
+        codes = np.asarray(codes, dtype=np.int64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        for start in range(0, len(codes), FIELD_CHUNK):
+            self.__writeChunk(codes[start:start+FIELD_CHUNK], lengths[start:start+FIELD_CHUNK])
+
+    def __writeChunk(self, codes, lengths):
+        total = int(lengths.sum())
+        if total == 0:
+            return
+        # for each output bit, the field it belongs to and how far to shift it down
+        ends = np.cumsum(lengths)
+        shifts = np.repeat(ends, lengths) - np.arange(1, total + 1)
+        bits = (np.repeat(codes, lengths) >> shifts).astype(np.uint8) & 1
+        bits = np.concatenate((self.pending, bits))
+        full = len(bits) - len(bits) % 8
+        self.buffer += stuffBytes(np.packbits(bits[:full]))
+        self.pending = bits[full:]
+        self.bit_count += total
+
+    def writeMarker(self, marker):
+        # byte align (padding with 1s) and write 0xFF marker unstuffed,
+        # e.g. a restart marker between independently decodable segments
+        self.flush()
+        self.buffer += bytes([0xFF, marker])
+
+    def flush(self):
+        # pad the final byte with 1s, as jpeg does, and return the stream
+        if len(self.pending):
+            pad = 8 - len(self.pending)
+            self.writeFields([(1 << pad) - 1], [pad])
+            self.bit_count -= pad
+        return bytes(self.buffer)
+
+# codes up to this many bits are decoded with a single table lookup
+FAST_BITS = 9
+
+def buildLookup(codeword_dict, fast_bits=FAST_BITS):
+    # decoding tables for a {symbol: codeword} dict. every fast_bits-bit value
+    # that starts with a short code maps straight to (symbol, length), codes
+    # longer than fast_bits go in a {(length, code): symbol} dict instead
+    fast_symbols, fast_lengths = [None] * (1 << fast_bits), [0] * (1 << fast_bits)
+    slow = dict()
+    for symbol, codeword in codeword_dict.items():
+        length, code = len(codeword), int(codeword, 2)
+        if length <= fast_bits:
+            shift = fast_bits - length
+            for entry in range(code << shift, (code + 1) << shift):
+                fast_symbols[entry], fast_lengths[entry] = symbol, length
+        else:
+            slow[(length, code)] = symbol
+    max_length = max(len(codeword) for codeword in codeword_dict.values())
+    return tuple(fast_symbols), tuple(fast_lengths), MappingProxyType(slow), fast_bits, max_length
+
+# source bytes unstuffed and buffered per refill in bitreader
+READ_CHUNK = 1 << 16
+
+class bitreader:
+    def __init__(self, data, stuffed=True):
+        # data can be any buffer, e.g. a view of a mapped file - it is only
+        # read a chunk at a time as decoding reaches it
+        self.source = data
+        self.source_pos = 0
+        self.stuffed = stuffed
+        self.buffer = b''
+        self.pos = 0
+
+    def __refill(self):
+        # drop the bytes already consumed and append the next source chunk
+        self.buffer = self.buffer[self.pos >> 3:]
+        self.pos &= 7
+        if self.source_pos >= len(self.source):
+            raise ValueError("Read past the end of the bit stream")
+        chunk_end = self.source_pos + READ_CHUNK
+        if self.stuffed and chunk_end < len(self.source) and self.source[chunk_end-1] == 0xFF:
+            # don't split a 0xFF from its stuffed 0x00
+            chunk_end += 1
+        chunk = bytes(self.source[self.source_pos:chunk_end])
+        self.source_pos = chunk_end
+        if self.stuffed:
+            chunk = unstuffBytes(chunk)
+        self.buffer += chunk
+        if self.source_pos >= len(self.source):
+            # a few bytes of 1s past the end keep 32-bit peeks in range
+            self.buffer += b'\xff' * 4
+
+    def peek(self, length):
+        # next length bits (at most 25) as an int, without consuming them
+        byte_i = self.pos >> 3
+        if byte_i + 4 > len(self.buffer):
+            self.__refill()
+            byte_i = self.pos >> 3
+        word = int.from_bytes(self.buffer[byte_i:byte_i+4], 'big')
+        return (word >> (32 - (self.pos & 7) - length)) & ((1 << length) - 1)
+
+    def read(self, length):
+        value = self.peek(length)
+        self.pos += length
+        return value
+
+    def readSymbol(self, lookup):
+        # decode one huffman symbol with a table from buildLookup
+        fast_symbols, fast_lengths, slow, fast_bits, max_length = lookup
+        entry = self.peek(fast_bits)
+        length = fast_lengths[entry]
+        if length:
+            self.pos += length
+            return fast_symbols[entry]
+        for length in range(fast_bits + 1, max_length + 1):
+            symbol = slow.get((length, self.peek(length)))
+            if symbol is not None:
+                self.pos += length
+                return symbol
+        raise ValueError("Invalid huffman code at bit " + str(self.pos))
+
+    def readMagnitude(self, category):
+        # inverse of encoder.categorizeArray's magnitudes: a leading 0 marks a negative value
+        if category == 0:
+            return 0
+        value = self.read(category)
+        if value < 1 << (category - 1):
+            value -= (1 << category) - 1
+        return value
@@ -0,0 +1,55 @@
+import numpy as np
+
+# Quantized DCT coefficients of a whole image in one contiguous int16 buffer.
+# The layout is fixed at (channels, blocks, 64): blocks are in raster order
+# and each one holds its coefficients in zig zag order. The encoder, the
+# embedders and the extractors all index this same memory, so there are no
+# nested per-channel arrays or reshaped copies passed between stages.
+
+class coefimage:
+    def __init__(self, num_channels, ver_block_count, hor_block_count, block_size=8, coefs=None):
+        self.BLOCK_SIZE = block_size
+        self.ver_block_count, self.hor_block_count = ver_block_count, hor_block_count
+        self.total_blocks = ver_block_count * hor_block_count
+        shape = (num_channels, self.total_blocks, block_size*block_size)
+        if coefs is None:
+            self.coefs = np.zeros(shape, dtype=np.int16)
+        else:
+            self.coefs = np.ascontiguousarray(coefs, dtype=np.int16).reshape(shape)
+
+    @property
+    def shape(self):
+        return self.coefs.shape
+
+    def __len__(self):
+        return len(self.coefs)
+
+    def __iter__(self):
+        return iter(self.coefs)
+
+    def __getitem__(self, key):
+        return self.coefs[key]
+
+    def __setitem__(self, key, value):
+        self.coefs[key] = value
+
+    def __array__(self, dtype=None, copy=None):
+        return self.coefs if dtype is None else self.coefs.astype(dtype)
+
+    def blockIndex(self, row_i, block_i):
+        # (row, col) of a block in the grid -> its index within a channel
+        return row_i * self.hor_block_count + block_i
+
+    def blockRowCol(self, block):
+        # index within a channel -> (row, col) of the block in the grid
+        return block // self.hor_block_count, block % self.hor_block_count
+
+    def splitIndex(self, block_num):
+        # index over all blocks of all channels -> (channel, row, col)
+        channel_i, block = block_num // self.total_blocks, block_num % self.total_blocks
+        row_i, block_i = self.blockRowCol(block)
+        return channel_i, row_i, block_i
+
+    def grid(self):
+        # (channels, rows, cols, 64) view of the same buffer
+        return self.coefs.reshape((len(self.coefs), self.ver_block_count, self.hor_block_count, self.BLOCK_SIZE*self.BLOCK_SIZE))
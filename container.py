@@ -0,0 +1,49 @@
+import mmap
+import struct
+import numpy as np
+
+# File format for the verbose pipeline's entropy coded stream.
+# A fixed big-endian header (magic, version, block size, channel count,
+# table count, visible height and width, restart interval, segment count,
+# stream length) is followed by the uint16 quant tables, the uint64 byte
+# offset of every restart segment, and then the byte-stuffed stream.
+# Reading maps the file, so the stream is handed out as a view and paged
+# in as it's decoded.
+
+MAGIC = b'SF5S'
+VERSION = 2
+HEADER = struct.Struct('>4sBBBBIIIIQ')
+
+def writeContainer(file_name, stream, v_img_dims, quant_tables, num_channels, restart_interval=None, segment_starts=(0,)):
+    quant_tables = np.asarray(quant_tables, dtype='>u2')
+    num_tables, block_size = quant_tables.shape[:2]
+    v_img_height, v_img_width = v_img_dims
+    segment_starts = np.asarray(segment_starts, dtype='>u8')
+    with open(file_name, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, block_size, num_channels, num_tables, v_img_height, v_img_width,
+                            restart_interval or 0, len(segment_starts), len(stream)))
+        f.write(quant_tables.tobytes())
+        f.write(segment_starts.tobytes())
+        f.write(stream)
+
+def readContainer(file_name):
+    # returns ((visible height, width), channel count, quant tables,
+    # stream view, restart interval (0 if none), segment start offsets)
+    with open(file_name, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(data) < HEADER.size:
+        raise ValueError(file_name + " is not a stego stream file")
+    (magic, version, block_size, num_channels, num_tables, v_img_height, v_img_width,
+     restart_interval, num_segments, stream_len) = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(file_name + " is not a stego stream file")
+    table_len = num_tables * block_size * block_size * 2
+    quant_tables = np.frombuffer(data, dtype='>u2', count=table_len // 2, offset=HEADER.size)
+    quant_tables = quant_tables.reshape((num_tables, block_size, block_size)).astype(np.int64)
+    index_start = HEADER.size + table_len
+    stream_start = index_start + num_segments * 8
+    if stream_start + stream_len > len(data):
+        raise ValueError(file_name + " is truncated")
+    segment_starts = np.frombuffer(data, dtype='>u8', count=num_segments, offset=index_start).astype(np.int64)
+    stream = memoryview(data)[stream_start:stream_start + stream_len]
+    return (v_img_height, v_img_width), num_channels, quant_tables, stream, restart_interval, segment_starts
@@ -0,0 +1,41 @@
+import numpy as np
+
+# Batched 2D DCT-II/DCT-III over stacks of square blocks.
+# Uses the same orthonormal scaling as cv2.dct/cv2.idct, so coefficients
+# are interchangeable with the per-block opencv calls it replaces.
+# Every block is transformed at once: for a block B and basis C the
+# forward transform is C.B.C^T, which is done as two tall 2D matrix
+# products over all rows of all blocks instead of one call per block.
+
+class dct:
+    def __init__(self, block_size, precision=np.float32):
+        if np.dtype(precision) not in (np.float32, np.float64):
+            raise ValueError("DCT precision must be float32 or float64")
+        self.BLOCK_SIZE = block_size
+        self.precision = np.dtype(precision)
+        self.basis = self.genBasis(block_size).astype(self.precision)
+
+    def genBasis(self, n):
+        # orthonormal DCT-II matrix, row k holds the k-th cosine
+        k = np.arange(n).reshape((n, 1))
+        i = np.arange(n).reshape((1, n))
+        basis = np.sqrt(2 / n) * np.cos(np.pi * (2*i + 1) * k / (2*n))
+        basis[0] /= np.sqrt(2)
+        return basis
+
+    def __transform(self, blocks, m):
+        # returns m.B.m^T for every block B in the last two axes
+        blocks = np.asarray(blocks, dtype=self.precision)
+        shape = blocks.shape
+        out = (blocks.reshape((-1, self.BLOCK_SIZE)) @ m.T).reshape(shape) # B.m^T
+        out = out.swapaxes(-1, -2) # m.B^T
+        out = (out.reshape((-1, self.BLOCK_SIZE)) @ m.T).reshape(shape) # m.B^T.m^T
+        return out.swapaxes(-1, -2)
+
+    def forward(self, blocks):
+        # (..., 8, 8) pixel blocks -> (..., 8, 8) DCT coefficients
+        return self.__transform(blocks, self.basis)
+
+    def inverse(self, coefs):
+        # (..., 8, 8) DCT coefficients -> (..., 8, 8) pixel blocks
+        return self.__transform(coefs, self.basis.T)
@@ -2,26 +2,43 @@
 import numpy as np
 import cv2
 import math
-import pickle
 import os.path
+from concurrent.futures import ProcessPoolExecutor
 from Crypto.Cipher import AES
 import simplejpeg
+import jpeglib
 
 from sdcs import sdcs
 from stc import stc
 from rs import rs
+from dct import dct
+from jpegtables import getZigZag, Y_QUANT_TABLE, C_QUANT_TABLE, DC_CODEWORDS, DC_CODEWORDS_INV, AC_CODEWORDS, AC_CODEWORDS_INV, DC_LOOKUP, AC_LOOKUP
+from coefimage import coefimage
+from bitstream import bitreader
+from container import readContainer
+from keyorder import keyedGenerator, LENGTH_BITS, ORDER_CHUNK
 
 #############################################
 
 class decoder:
-    def __init__(self, block_size, rs_param):
+    def __init__(self, block_size, rs_param, precision=np.float32, stripe_rows=32, workers=None):
         self.BLOCK_SIZE = block_size
         self.RS_PARAM = rs_param
+        self.PRECISION = precision
+        # block rows pushed through the inverse DCT at once, None for the whole image
+        self.STRIPE_ROWS = stripe_rows
+        # processes for decoding restart segments, None for one per core, 1 for serial
+        self.WORKERS = workers
+        # sdcs (n, k, m) groups and coefficient vector a, as in the encoder
+        self.SDCS_PARAMS, self.SDCS_A = (3, 2, 17), [1, 2, 6]
+        self.dct_obj = dct(block_size, precision)
         self.img_height, self.img_width = None, None
         self.hor_block_count, self.ver_block_count = None, None
-        self.Y_quant_table, self.C_quant_table = self.__getQuantTables()
-        self.dc_codeword_dict, self.dc_codeword_dict_inv = self.__getDCCodewordDicts()
-        self.ac_codeword_dict, self.ac_codeword_dict_inv = self.__getACCodewordDicts()
+        # constant tables are shared by every instance, see jpegtables
+        self.Y_quant_table, self.C_quant_table = Y_QUANT_TABLE, C_QUANT_TABLE
+        self.dc_codeword_dict, self.dc_codeword_dict_inv = DC_CODEWORDS, DC_CODEWORDS_INV
+        self.ac_codeword_dict, self.ac_codeword_dict_inv = AC_CODEWORDS, AC_CODEWORDS_INV
+        self.dc_lookup, self.ac_lookup = DC_LOOKUP, AC_LOOKUP
 
     def getImageDimensions(self, img):
         # return image height, width as integers
@@ -32,360 +49,108 @@ class decoder:
         self.hor_block_count = h
         self.ver_block_count = v
 
-    def __getQuantTables(self):
-        Y_quant_table = np.array([[
-            16, 11, 10, 16, 24, 40, 51, 61],
-        [12, 12, 14, 19, 26, 58, 60, 55],
-        [14, 13, 16, 24, 40, 57, 69, 56],
-        [14, 17, 22, 29, 51, 87, 80, 62],
-        [18, 22, 37, 56, 68, 109, 103, 77],
-        [24, 36, 55, 64, 81, 104, 113, 92],
-        [49, 64, 78, 87, 103, 121, 120, 101],
-        [72, 92, 95, 98, 112, 100, 103, 99
-        ]])
-
-        C_quant_table = np.array([[
-            17, 18, 24, 47, 99, 99, 99, 99],
-        [18, 21, 26, 66, 99, 99, 99, 99],
-        [24, 26, 56, 99, 99, 99, 99, 99],
-        [47, 66, 99, 99, 99, 99, 99, 99],
-        [99, 99, 99, 99, 99, 99, 99, 99],
-        [99, 99, 99, 99, 99, 99, 99, 99],
-        [99, 99, 99, 99, 99, 99, 99, 99],
-        [99, 99, 99, 99, 99, 99, 99, 99
-        ]])
-
-        return Y_quant_table, C_quant_table
-
-    def __getDCCodewordDicts(self):
-        dc_codeword_dict = {
-                0: '00',
-                1: '010',
-                2: '011',
-                3: '100',
-                4: '101',
-                5: '110',
-                6: '1110',
-                7: '11110',
-                8: '111110',
-                9: '1111110',
-                10: '11111110',
-                11: '111111110'
-            }
-
-        dc_codeword_dict_inv = {codeword: cat for cat, codeword in dc_codeword_dict.items()}
-
-        return dc_codeword_dict, dc_codeword_dict_inv
-
-    def __getACCodewordDicts(self):
-        ac_codeword_dict = {
-            (0,0): '1010',
-            (0,1): '00',
-            (0,2): '01',
-            (0,3): '100',
-            (0,4): '1011',
-            (0,5): '11010',
-            (0,6): '1111000',
-            (0,7): '11111000',
-            (0,8): '1111110110',
-            (0,9): '1111111110000010',
-            (0,10): '1111111110000011',
-            (1,1): '1100',
-            (1,2): '11011',
-            (1,3): '1111001',
-            (1,4): '111110110',
-            (1,5): '11111110110',
-            (1,6): '1111111110000100',
-            (1,7): '1111111110000101',
-            (1,8): '1111111110000110',
-            (1,9): '1111111110000111',
-            (1,10): '1111111110001000',
-            (2,1): '11100',
-            (2,2): '11111001',
-            (2,3): '1111110111',
-            (2,4): '111111110100',
-            (2,5): '1111111110001001',
-            (2,6): '1111111110001010',
-            (2,7): '1111111110001011',
-            (2,8): '1111111110001100',
-            (2,9): '1111111110001101',
-            (2,10): '1111111110001110',
-            (3,1): '111010',
-            (3,2): '111110111',
-            (3,3): '111111110101',
-            (3,4): '1111111110001111',
-            (3,5): '1111111110010000',
-            (3,6): '1111111110010001',
-            (3,7): '1111111110010010',
-            (3,8): '1111111110010011',
-            (3,9): '1111111110010100',
-            (3,10): '1111111110010101',
-            (4,1): '111011',
-            (4,2): '1111111000',
-            (4,3): '1111111110010110',
-            (4,4): '1111111110010111',
-            (4,5): '1111111110011000',
-            (4,6): '1111111110011001',
-            (4,7): '1111111110011010',
-            (4,8): '1111111110011011',
-            (4,9): '1111111110011100',
-            (4,10): '1111111110011101',
-            (5,1): '1111010',
-            (5,2): '11111110111',
-            (5,3): '1111111110011110',
-            (5,4): '1111111110011111',
-            (5,5): '1111111110100000',
-            (5,6): '1111111110100001',
-            (5,7): '1111111110100010',
-            (5,8): '1111111110100011',
-            (5,9): '1111111110100100',
-            (5,10): '1111111110100101',
-            (6,1): '1111011',
-            (6,2): '111111110110',
-            (6,3): '1111111110100110',
-            (6,4): '1111111110100111',
-            (6,5): '1111111110101000',
-            (6,6): '1111111110101001',
-            (6,7): '1111111110101010',
-            (6,8): '1111111110101011',
-            (6,9): '1111111110101100',
-            (6,10): '1111111110101101',
-            (7,1): '11111010',
-            (7,2): '111111110111',
-            (7,3): '1111111110101110',
-            (7,4): '1111111110101111',
-            (7,5): '1111111110110000',
-            (7,6): '1111111110110001',
-            (7,7): '1111111110110010',
-            (7,8): '1111111110110011',
-            (7,9): '1111111110110100',
-            (7,10): '1111111110110101',
-            (8,1): '111111000',
-            (8,2): '111111111000000',
-            (8,3): '1111111110110110',
-            (8,4): '1111111110110111',
-            (8,5): '1111111110111000',
-            (8,6): '1111111110111001',
-            (8,7): '1111111110111010',
-            (8,8): '1111111110111011',
-            (8,9): '1111111110111100',
-            (8,10): '1111111110111101',
-            (9,1): '111111001',
-            (9,2): '1111111110111110',
-            (9,3): '1111111110111111',
-            (9,4): '1111111111000000',
-            (9,5): '1111111111000001',
-            (9,6): '1111111111000010',
-            (9,7): '1111111111000011',
-            (9,8): '1111111111000100',
-            (9,9): '1111111111000101',
-            (9,10): '1111111111000110',
-            (10,1): '111111010',
-            (10,2): '1111111111000111',
-            (10,3): '1111111111001000',
-            (10,4): '1111111111001001',
-            (10,5): '1111111111001010',
-            (10,6): '1111111111001011',
-            (10,7): '1111111111001100',
-            (10,8): '1111111111001101',
-            (10,9): '1111111111001110',
-            (10,10): '1111111111001111',
-            (11,1): '1111111001',
-            (11,2): '1111111111010000',
-            (11,3): '1111111111010001',
-            (11,4): '1111111111010010',
-            (11,5): '1111111111010011',
-            (11,6): '1111111111010100',
-            (11,7): '1111111111010101',
-            (11,8): '1111111111010110',
-            (11,9): '1111111111010111',
-            (11,10): '1111111111011000',
-            (12,1): '1111111010',
-            (12,2): '1111111111011001',
-            (12,3): '1111111111011010',
-            (12,4): '1111111111011011',
-            (12,5): '1111111111011100',
-            (12,6): '1111111111011101',
-            (12,7): '1111111111011110',
-            (12,8): '1111111111011111',
-            (12,9): '1111111111100000',
-            (12,10): '1111111111100001',
-            (13,1): '11111111000',
-            (13,2): '1111111111100010',
-            (13,3): '1111111111100011',
-            (13,4): '1111111111100100',
-            (13,5): '1111111111100101',
-            (13,6): '1111111111100110',
-            (13,7): '1111111111100111',
-            (13,8): '1111111111101000',
-            (13,9): '1111111111101001',
-            (13,10): '1111111111101010',
-            (14,1): '1111111111101011',
-            (14,2): '1111111111101100',
-            (14,3): '1111111111101101',
-            (14,4): '1111111111101110',
-            (14,5): '1111111111101111',
-            (14,6): '1111111111110000',
-            (14,7): '1111111111110001',
-            (14,8): '1111111111110010',
-            (14,9): '1111111111110011',
-            (14,10): '1111111111110100',
-            (15,1): '1111111111110101',
-            (15,2): '1111111111110110',
-            (15,3): '1111111111110111',
-            (15,4): '1111111111111000',
-            (15,5): '1111111111111001',
-            (15,6): '1111111111111010',
-            (15,7): '1111111111111011',
-            (15,8): '1111111111111100',
-            (15,9): '1111111111111101',
-            (15,10): '1111111111111110',
-            (15,0): '11111111001'
-        }
-
-        ac_codeword_dict_inv = {codeword: cat for cat, codeword in ac_codeword_dict.items()}
-
-        return ac_codeword_dict, ac_codeword_dict_inv
-
-    def onesComp(self, bitstring):
-        oc_bitstring = ''
-        for char in bitstring:
-            if char == '1':
-                oc_bitstring += '0'
-            elif char == '0':
-                oc_bitstring += '1'
-        return oc_bitstring
-
-    def huffmanDecode(self, bitstring):
-        cur_bitstream = ''
-        cur_bit_i, YCbCr_num = 0, 0
-        DC_flag = True
-        Y_decoded_img, Y_decoded_block = list(), list()
-        Cb_decoded_img, Cb_decoded_block = list(), list()
-        Cr_decoded_img, Cr_decoded_block = list(), list()
-        bitstring_length = len(bitstring)
-        decoded_img = Y_decoded_img # set default value to remove warnings
-        decoded_block = Y_decoded_block # ^^
-        while cur_bit_i < bitstring_length:
-            cur_bitstream += bitstring[cur_bit_i]
-            if YCbCr_num == 0:
-                decoded_img = Y_decoded_img
-                decoded_block = Y_decoded_block
-            elif YCbCr_num == 1:
-                decoded_img = Cb_decoded_img
-                decoded_block = Cb_decoded_block
-            elif YCbCr_num == 2:
-                decoded_img = Cr_decoded_img
-                decoded_block = Cr_decoded_block
-            try:
-                if DC_flag:
-                    category = self.dc_codeword_dict_inv[cur_bitstream]
-                    DC_flag = False
-                    cur_bit_i += 1
-                    if category != 0:
-                        dc_magnitude = ''
-                        dc_magnitude_len = cur_bit_i + category
-                        while cur_bit_i < dc_magnitude_len:
-                            dc_magnitude += bitstring[cur_bit_i]
-                            cur_bit_i += 1
-                        if dc_magnitude[0] == '0':
-                            dc_magnitude = self.onesComp(dc_magnitude)
-                            dc_magnitude = -1 * int(dc_magnitude, 2)
-                        else:
-                            dc_magnitude = int(dc_magnitude, 2)
-                        decoded_block.append(dc_magnitude)
-                    elif category == 0:
-                        decoded_block.append(0)
-                    cur_bitstream = ''
-                    continue
-                else:
-                    category = self.ac_codeword_dict_inv[cur_bitstream]
-                    if category == (0,0):
-                        YCbCr_num = (YCbCr_num + 1) % 3
-                        if YCbCr_num == 0:
-                            Cr_decoded_block = list()
-                        elif YCbCr_num == 1:
-                            Y_decoded_block = list()
-                        elif YCbCr_num == 2:
-                            Cb_decoded_block = list()
-                        DC_flag = True
-                        decoded_img.append(decoded_block)
-                        decoded_block = list()
-                        cur_bit_i += 1
-                        cur_bitstream = ''
-                        continue
-                    elif category == (15,0):
-                        decoded_block.append([category[0], 0])
-                        cur_bitstream = ''
-                        cur_bit_i += 1
-                        continue
-                    else:
-                        cur_bit_i += 1
-                        ac_magnitude = ''
-                        ac_magnitude_len = cur_bit_i + category[1]
-                        while cur_bit_i < ac_magnitude_len:
-                            ac_magnitude += bitstring[cur_bit_i]
-                            cur_bit_i += 1
-                        if ac_magnitude[0] == '0':
-                            ac_magnitude = self.onesComp(ac_magnitude)
-                            ac_magnitude = -1 * int(ac_magnitude, 2)
-                        else:
-                            ac_magnitude = int(ac_magnitude, 2)
-                        decoded_block.append([category[0], ac_magnitude])
-                        cur_bitstream = ''
-                        continue
-            except:
-                cur_bit_i += 1
-                continue
-        return Y_decoded_img, Cb_decoded_img, Cr_decoded_img
+    def huffmanDecode(self, reader, num_channels=3, total_blocks=None):
+        # decode the entropy coded stream from a bitreader into the same layout
+        # RLEandDPCM produces: per channel, a DPCM DC array and a flat array of
+        # [skip, value] AC pairs with [0,0] closing each block. the arrays are
+        # allocated up front, a block holds at most 63 pairs plus its EOB
+        if total_blocks is None:
+            total_blocks = self.ver_block_count * self.hor_block_count
+        dc_arrs = np.zeros((num_channels, total_blocks), dtype=np.int16)
+        ac_arrs = np.zeros((num_channels, total_blocks * self.BLOCK_SIZE*self.BLOCK_SIZE, 2), dtype=np.int16)
+        ac_counts = [0] * num_channels
+        for block in range(total_blocks):
+            # blocks are interleaved across channels
+            for channel_i in range(num_channels):
+                category = reader.readSymbol(self.dc_lookup)
+                dc_arrs[channel_i, block] = reader.readMagnitude(category)
+                ac_arr, ac_i = ac_arrs[channel_i], ac_counts[channel_i]
+                while True:
+                    skip, category = reader.readSymbol(self.ac_lookup)
+                    ac_arr[ac_i] = skip, reader.readMagnitude(category)
+                    ac_i += 1
+                    if skip == 0 and category == 0:
+                        break
+                ac_counts[channel_i] = ac_i
+        img = list()
+        for channel_i in range(num_channels):
+            img += [dc_arrs[channel_i], ac_arrs[channel_i, :ac_counts[channel_i]]]
+        return img
 
     def unRLE(self, img):
-        final_img = list()
-        for channel in img:
-            zz_img = list()
-            for block in channel:
-                zz_block = np.zeros(64)
-                zz_block[0] = block[0]
-                block_len = len(block)
-                ac_val_i = 0
-                for ac_arr_i in range(1, block_len):
-                    ac_val_i += block[ac_arr_i][0] + 1
-                    zz_block[ac_val_i] = block[ac_arr_i][1]
-                zz_img.append(zz_block)
-            final_img.append(np.array(zz_img))
-        return np.array(final_img)
-
-    def unDPCM(self, zz_img):
-        final_img = list()
-        for channel in zz_img:
-            cur_dc_val = channel[0][0]
-            img_len = len(channel)
-            for dc_count in range(1, img_len):
-                cur_dc_val += channel[dc_count][0]
-                channel[dc_count][0] = cur_dc_val
-            final_img.append(channel)
+        # expand the flat [skip, value] pairs back into (channels, blocks, 64) zig zags.
+        # an entry's block is the number of [0,0] markers before it, and its
+        # position is the running sum of skip+1 since that block started
+        dc_arrs, ac_arrs = img[0::2], img[1::2]
+        final_img = np.zeros((len(dc_arrs), len(dc_arrs[0]), self.BLOCK_SIZE*self.BLOCK_SIZE), dtype=np.int16)
+        for channel_i, (dc_arr, ac_arr) in enumerate(zip(dc_arrs, ac_arrs)):
+            final_img[channel_i, :, 0] = dc_arr
+            skips, values = np.asarray(ac_arr, dtype=np.int64).T
+            is_eob = (skips == 0) & (values == 0)
+            steps = np.where(is_eob, 0, skips + 1)
+            positions = np.cumsum(steps)
+            blocks = np.cumsum(is_eob) - is_eob
+            block_starts = np.concatenate(([0], positions[is_eob]))
+            positions -= block_starts[blocks]
+            nonzero = values != 0
+            final_img[channel_i, blocks[nonzero], positions[nonzero]] = values[nonzero]
         return final_img
 
+    def huffmanDecodeSegments(self, stream, num_channels, restart_interval, segment_starts):
+        # decode a stream cut into restart segments. each segment is byte
+        # aligned and holds restart_interval blocks, so they are decoded in a
+        # process pool and their arrays joined in order
+        total_blocks = self.ver_block_count * self.hor_block_count
+        segments, segment_blocks = list(), list()
+        for segment_i, start in enumerate(segment_starts):
+            if segment_i + 1 < len(segment_starts):
+                # the next segment starts after an RSTn marker
+                end = segment_starts[segment_i + 1] - 2
+                if bytes(stream[end:end+2]) != bytes([0xFF, 0xD0 + segment_i % 8]):
+                    raise ValueError("Missing restart marker before segment " + str(segment_i + 1))
+            else:
+                end = len(stream)
+            segments.append(bytes(stream[start:end]))
+            segment_blocks.append(min(restart_interval, total_blocks - segment_i * restart_interval))
+        if self.WORKERS == 1 or len(segments) == 1:
+            decoded = [self.huffmanDecode(bitreader(segment), num_channels, blocks) for segment, blocks in zip(segments, segment_blocks)]
+        else:
+            with ProcessPoolExecutor(max_workers=self.WORKERS) as pool:
+                chunksize = max(1, len(segments) // (4 * (self.WORKERS or os.cpu_count() or 1)))
+                decoded = list(pool.map(decodeSegment, segments, [num_channels] * len(segments), segment_blocks,
+                                        [self.BLOCK_SIZE] * len(segments), chunksize=chunksize))
+        return [np.concatenate(arrs) for arrs in zip(*decoded)]
+
+    def unDPCM(self, zz_img, restart_interval=None):
+        # each DC value is the running sum of the differences before it,
+        # starting over at every restart
+        zz_img = np.asarray(zz_img)
+        restart_interval = restart_interval or zz_img.shape[1]
+        for start in range(0, zz_img.shape[1], restart_interval):
+            segment = zz_img[:, start:start+restart_interval, 0]
+            segment[...] = np.cumsum(segment, axis=1)
+        return zz_img
+
     def unZigZag(self, zz_img):
-        id_block = np.reshape(np.arange(self.BLOCK_SIZE*self.BLOCK_SIZE), (self.BLOCK_SIZE, self.BLOCK_SIZE))
-        indices = np.hstack([np.diagonal(id_block[::-1,:], k)[::(2*(k % 2)-1)] for k in range(1-id_block.shape[0], id_block.shape[0])])
-        final_img = list()
-        for channel in zz_img:
-            img=list()
-            for zz_block in channel:
-                block = np.zeros(self.BLOCK_SIZE*self.BLOCK_SIZE)
-                for i, ind in enumerate(indices):
-                    block[ind] = zz_block[i]
-                img.append(np.reshape(block, (self.BLOCK_SIZE,self.BLOCK_SIZE)))
-            final_img.append(np.reshape(img, (self.hor_block_count,self.ver_block_count,self.BLOCK_SIZE,self.BLOCK_SIZE)))
-        return np.array(final_img)
+        # scatter every 64-len zig zag array back into raster order with the
+        # precomputed inverse permutation, then restore the 8x8 tile grid
+        _, unzigzag = getZigZag(self.BLOCK_SIZE)
+        zz_img = np.asarray(zz_img)
+        img = zz_img[..., unzigzag]
+        return img.reshape((len(zz_img), self.ver_block_count, self.hor_block_count, self.BLOCK_SIZE, self.BLOCK_SIZE))
+
+    def getQuantTableStack(self, num_channels):
+        # (channels, 8, 8) stack of tables: luma for channel 0, chroma for the rest
+        return np.array([self.Y_quant_table] + [self.C_quant_table] * (num_channels - 1))
 
     def deQuantize(self, img):
-        final_img = list()
-        for i, channel in enumerate(img):
-            table = self.Y_quant_table if i == 0 else self.C_quant_table
-            final_img.append(np.array([np.multiply(block, table) for block in np.array([row for row in channel])]))
-        return np.array(final_img)
+        # multiply every block of every channel by its table in one broadcast,
+        # in-place once the coefs are in a float buffer
+        img = np.asarray(img, dtype=self.PRECISION)
+        tables = self.getQuantTableStack(len(img))
+        tables = tables.reshape((len(img),) + (1,) * (img.ndim - 3) + tables.shape[1:])
+        np.multiply(img, tables, out=img)
+        return img
 
     def w(self, k_num):
         # for use in DCT transformation
@@ -396,7 +161,7 @@ class decoder:
 
     def DCT_3(self, img):
         # basically the same as DCT2, but returns Y values from DCT coefs!
-        return np.array([np.array([np.array([cv2.idct(block) for block in row]) for row in channel]) for channel in img])
+        return self.dct_obj.inverse(img)
 
     def BGR_convert(self, YCbCr):
         # values from https://wikipedia.org/wiki/YCbCr#JPEG_conversion
@@ -406,55 +171,53 @@ class decoder:
         R = Y + 1.402*(Cr-128)
         return B, G, R
 
-    def YCbCr2BGR(self, orig_img):
-        img = list()
-        # I know this looks bad but it's only O(n^2)!
-        for row in range(self.ver_block_count):
-            img_tiles = list()
-            for column in range(self.hor_block_count):
-                BGR_block = list()
-                for block in range(self.BLOCK_SIZE):
-                    pixel_row = list()
-                    for pixel_i in range(self.BLOCK_SIZE):
-                        Y_val = orig_img[0][row][column][block][pixel_i]
-                        Cb_val = orig_img[1][row][column][block][pixel_i]
-                        Cr_val = orig_img[2][row][column][block][pixel_i]
-                        pixel_row.append(np.array(self.BGR_convert([Y_val, Cb_val, Cr_val])))
-                    BGR_block.append(np.array(pixel_row))
-                img_tiles.append(np.array(BGR_block))
-            img.append(np.array(img_tiles))
-        return np.array(img)
+    def YCbCr2BGR(self, img):
+        # full-frame conversion of an assembled (height, width, 3) Y/Cb/Cr image:
+        # remove the chroma offset and push every pixel through the same 3x3
+        # matrix as BGR_convert in a single product
+        bgr_matrix = np.array([
+            [1, 1.772, 0],
+            [1, -0.344136, -0.714136],
+            [1, 0, 1.402]])
+        return (img - np.array([0, 128, 128])) @ bgr_matrix.T
 
     def assembleImage(self, img_tiles):
-        img, row = list(), list()
-        num_rows = len(img_tiles)
-        for row_i in range(num_rows):
-            num_cols = len(img_tiles[row_i])
-            for pixel in range(self.BLOCK_SIZE):
-                for col_i in range(num_cols):
-                    block_len = len(img_tiles[row_i][col_i])
-                    for block in range(block_len):
-                        row.append(img_tiles[row_i][col_i][pixel][block])
-                img.append(np.array(row))
-                row = list()
-        return np.array(img)
-
-    def removeHPadding(self, img, v_img_width):
-        img_list = list(img)
-        width = self.img_width
-        while width != v_img_width:
-            for row_index in range(len(img)):
-                row_list = list(img_list[row_index])
-                row_list.pop()
-                img_list[row_index] = row_list
-            width -= 1
-        return np.array(img_list)
-
-    def removeVPadding(self, img, v_img_height):
-        img_list = list(img)
-        while len(img_list) != v_img_height:
-            img_list.pop()
-        return np.array(img_list)
+        # inverse of encoder.blockify: (rows, cols, 8, 8, ...) tiles -> (height, width, ...)
+        # swapping the column and pixel-row axes back lets a single reshape
+        # lay the tiles out as pixel rows
+        img_tiles = np.asarray(img_tiles)
+        rows, cols = img_tiles.shape[:2]
+        img = img_tiles.swapaxes(1, 2)
+        return img.reshape((rows * self.BLOCK_SIZE, cols * self.BLOCK_SIZE) + img_tiles.shape[4:])
+
+    def removePadding(self, img, v_img_height, v_img_width):
+        # crop back to the visible dimensions - a slice, so no pixels are copied
+        return img[:v_img_height, :v_img_width]
+
+    def renderStripes(self, zz_img, v_img_height, v_img_width, greyscale=False):
+        # inverse of encoder.transformStripes: (channels, blocks, 64) zig zag coefs
+        # -> visible 8-bit BGR (or grey) image, built one stripe of block rows at a
+        # time so the float intermediates never cover the whole image
+        _, unzigzag = getZigZag(self.BLOCK_SIZE)
+        zz_img = np.asarray(zz_img)
+        num_channels = len(zz_img)
+        grid = zz_img.reshape((num_channels, self.ver_block_count, self.hor_block_count, self.BLOCK_SIZE*self.BLOCK_SIZE))
+        out = np.empty((v_img_height, v_img_width) + ((3,) if not greyscale else ()), dtype=np.uint8)
+        stripe_rows = self.STRIPE_ROWS or self.ver_block_count
+        for row_start in range(0, self.ver_block_count, stripe_rows):
+            row_end = min(row_start + stripe_rows, self.ver_block_count)
+            stripe = grid[:, row_start:row_end][..., unzigzag]
+            stripe = stripe.reshape(stripe.shape[:-1] + (self.BLOCK_SIZE, self.BLOCK_SIZE))
+            stripe = self.DCT_3(self.deQuantize(stripe))
+            stripe = self.assembleImage(np.moveaxis(stripe, 0, -1))
+            if not greyscale:
+                stripe = self.YCbCr2BGR(stripe)
+            else:
+                stripe = stripe[..., 0]
+            pixel_start = row_start * self.BLOCK_SIZE
+            stripe = self.removePadding(stripe, v_img_height - pixel_start, v_img_width)
+            out[pixel_start:pixel_start + len(stripe)] = np.clip(stripe, 0, 255)
+        return out
 
     def lsbF5(self, x):
         if x < 0:
@@ -512,7 +275,7 @@ class decoder:
         diff_manc = list()
         for loc in msg_path:
             channel_i, row_i, block_i, block_path = loc
-            block = (row_i * self.hor_block_count) + block_i%self.hor_block_count
+            block = img.blockIndex(row_i, block_i)
             for coef_i, manc_i in block_path:
                 diff_manc.append(manc_i)
                 try:
@@ -548,7 +311,7 @@ class decoder:
         map_sign = lambda x: 1 if math.copysign(1, x) == 1 else 0
         for loc in msg_path:
             channel_i, row_i, block_i, block_path = loc
-            block = (row_i * self.hor_block_count) + block_i%self.hor_block_count
+            block = img.blockIndex(row_i, block_i)
             y = list()
             diff_manc = list()
             #print(img[channel_i][block], block)
@@ -573,7 +336,7 @@ class decoder:
         bit_msg = ''
         for loc in msg_path:
             channel_i, row_i, block_i, block_path = loc
-            block = (row_i * self.hor_block_count) + block_i
+            block = img.blockIndex(row_i, block_i)
             y = list()
             for coef_i in block_path:
                 try:
@@ -586,43 +349,91 @@ class decoder:
         return bit_msg
 
     def extractsdcsF5(self, msg_path, img):
-        n,k,m,a = 3,2,17,[1,2,6]
+        (n, k, m), a = self.SDCS_PARAMS, self.SDCS_A
         f5_sdcs = sdcs((n,k,m), a)
-        bit_msg = ''
-        for bloc in msg_path:
-            # channel, global block, coefs
-            channel_i, row_i, block_i, coefs = bloc
-            block = (row_i * self.hor_block_count) + block_i%self.hor_block_count
-            sdcs_block = list()
-            for coef in coefs:
-                try:
-                    sdcs_block.append(img[channel_i][block][coef])
-                except:
-                    sdcs_block.append(0)
-            b = int(f5_sdcs.extract(sdcs_block))
-            b_bit = bin(b)[2:]
-            while len(b_bit) < math.floor(math.log(m, 2)):
-                b_bit = '0' + b_bit
-            bit_msg += b_bit
-        return bit_msg
-
-    def extractF5(self, msg_path, img, LSB):
-        bit_msg = ""
-        for bit_loc in msg_path:
-            channel = bit_loc[0]
-            row_i = bit_loc[1]
-            block_i = bit_loc[2]
-            coef_i = bit_loc[3]
-            block = (row_i * self.hor_block_count) + block_i
-            try:
-                coef = img[channel][block][coef_i]
-            except:
-                coef = np.random.choice([0,1])
-            if not LSB:
-                bit_msg += str(int(self.lsbF5(coef)))
+        # spread each [channel, row, block, coefs] entry over its coefs and read
+        # them in one go, short groups are padded with 0
+        entries = [[channel_i, row_i, block_i, coef] for channel_i, row_i, block_i, coefs in msg_path for coef in coefs]
+        lengths = np.array([len(coefs) for _, _, _, coefs in msg_path], dtype=np.int64)
+        groups = np.zeros((len(msg_path), n), dtype=np.int64)
+        if len(entries) > 0:
+            group_i = np.repeat(np.arange(len(msg_path)), lengths)
+            pos = np.arange(len(entries)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            groups[group_i, pos] = self.pathCoefs(entries, img)
+        b = f5_sdcs.extract(groups)
+        num_bits_per_int = math.floor(math.log(m, 2))
+        bits = (b[:, None] >> np.arange(num_bits_per_int-1, -1, -1)) & 1
+        return ''.join(map(str, bits.ravel().tolist()))
+
+    def pathCoefs(self, msg_path, img):
+        # coefs at the [channel, row, block, coef] entries of an F5/LSB path.
+        # entries that fall outside the image read as a random 0 or 1
+        msg_path = np.array(msg_path, dtype=np.int64).reshape((-1, 4))
+        channel, row_i, block_i, coef_i = msg_path.T
+        valid = ((channel < len(img)) & (row_i < img.ver_block_count) & (block_i < img.hor_block_count)
+                 & (coef_i < self.BLOCK_SIZE*self.BLOCK_SIZE) & (msg_path >= 0).all(axis=1))
+        coefs = np.random.randint(0, 2, len(msg_path)).astype(np.int64)
+        coefs[valid] = img[channel[valid], img.blockIndex(row_i[valid], block_i[valid]), coef_i[valid]]
+        return coefs
+
+    def extractF5Matrix(self, msg_path, img, k):
+        # path entries come in groups of 2^k-1 coefs, each one holding k bits as
+        # the xor of the 1-based positions of its members with lsb 1. a shorter
+        # group of 2^k'-1 coefs at the end holds the last k' bits
+        coefs = self.pathCoefs(msg_path, img)
+        lsbs = np.where(coefs < 0, (1 - coefs) % 2, coefs % 2)
+        n = 2**k - 1
+        full_groups, rest = divmod(len(lsbs), n)
+        codes = [(k, lsbs[:full_groups*n].reshape((-1, n)))]
+        if rest:
+            codes.append((int(rest + 1).bit_length() - 1, lsbs[full_groups*n:].reshape((1, rest))))
+        bit_msg = list()
+        for code_k, groups in codes:
+            syndromes = np.bitwise_xor.reduce(groups * np.arange(1, groups.shape[1]+1), axis=1)
+            bits = (syndromes[:, None] >> np.arange(code_k-1, -1, -1)) & 1
+            bit_msg.append(bits.ravel())
+        return ''.join(map(str, np.concatenate(bit_msg).tolist()))
+
+    def extractF5(self, msg_path, img, LSB, k=1):
+        if k > 1 and not LSB:
+            # matrix encoded F5
+            return self.extractF5Matrix(msg_path, img, k)
+        coefs = self.pathCoefs(msg_path, img)
+        if not LSB:
+            bits = np.where(coefs < 0, (1 - coefs) % 2, coefs % 2)
+        else:
+            bits = coefs % 2
+        return (bits.astype(np.uint8) + ord('0')).tobytes().decode()
+
+    def extractKeyed(self, img, key, LSB):
+        # walks the order encoder.F5/LSB used with keyed=True, rebuilt from the
+        # key, a chunk of blocks at a time. the first LENGTH_BITS bits give the
+        # message length, and reading stops once that many more are in
+        rng = keyedGenerator(key)
+        coefs = img.coefs.reshape((-1, self.BLOCK_SIZE*self.BLOCK_SIZE))
+        block_order = np.arange(len(coefs)) if LSB else rng.permutation(np.arange(len(coefs)))
+        bits, found, needed = list(), 0, None
+        for chunk_start in range(0, len(coefs), ORDER_CHUNK):
+            blocks = block_order[chunk_start:chunk_start+ORDER_CHUNK]
+            if LSB:
+                orders = np.argsort(rng.random((len(blocks), coefs.shape[1] - 1)), axis=1) + 1
+                hosts = coefs[blocks[:, None], orders]
+                hosts = hosts[hosts != 0].astype(np.int64)
+                bits.append(hosts % 2)
             else:
-                bit_msg += str(int(coef%2))
-        return bit_msg 
+                perm_i, coef_i = np.nonzero(coefs[blocks, 1:])
+                hosts = coefs[blocks[perm_i], coef_i + 1].astype(np.int64)
+                bits.append(np.where(hosts < 0, (1 - hosts) % 2, hosts % 2))
+            found += len(bits[-1])
+            if needed is None and found >= LENGTH_BITS:
+                length = np.concatenate(bits)[:LENGTH_BITS]
+                needed = LENGTH_BITS + int(length @ (1 << np.arange(LENGTH_BITS-1, -1, -1, dtype=np.int64)))
+            if needed is not None and found >= needed:
+                break
+        else:
+            raise ValueError("No message for this key - the image holds fewer bits than announced")
+        bits = np.concatenate(bits)[LENGTH_BITS:needed]
+        return (bits.astype(np.uint8) + ord('0')).tobytes().decode()
 
     def extractRSPoly(self, bit_msg):
         char, message = '', list()
@@ -656,13 +467,25 @@ class decoder:
         return np.array(list(path))
 
     def formatPathF5(self, path):
+        rsize = math.ceil(len(str(self.ver_block_count)) / 2)
+        bsize = math.ceil(len(str(self.hor_block_count)) / 2)
+        # F5 and LSB paths hold one coef per entry, so every entry has the same
+        # width and the fields can be read as columns of one digit array
+        entry_width = 2 * (rsize + bsize + 3)
+        if len(path) % entry_width == 0:
+            digits = np.asarray(path).astype('U1').view(np.uint32).astype(np.int64).reshape((-1, entry_width)) - ord('0')
+            if len(digits) and (digits[:, -2:] == 0).all():
+                fields = list()
+                start = 0
+                for width in (2, 2*rsize, 2*bsize, 2):
+                    fields.append(digits[:, start:start+width] @ 10 ** np.arange(width-1, -1, -1))
+                    start += width
+                return (np.stack(fields, axis=1) - 1).tolist()
         new_path = list()
         split_path = np.split(path, len(path)//2)
         split_path = [''.join([str(x) for x in a]) for a in split_path]
         partition = list()
         i = 0
-        rsize = math.ceil(len(str(self.ver_block_count)) / 2)
-        bsize = math.ceil(len(str(self.hor_block_count)) / 2)
         while i < len(split_path):
             partition += [int(split_path[i])-1]
             i += 1
@@ -712,39 +535,101 @@ class decoder:
             partition.append(block_path)
             new_path.append(partition)
             partition = list()
-            if split_path[i] == 'PB':
+            if i < len(split_path) and split_path[i] == 'PB':
                 parity_nums = split_path[i+1:]
                 parity_nums = [int(parity_nums[j] + parity_nums[j+1]) for j in range(0, len(parity_nums), 2)]
                 parity_polys = [parity_nums[j:j+2*rs_obj.T] for j in range(0, len(parity_nums), 2*rs_obj.T)]
                 return new_path, parity_polys
         return new_path
          
-    def decode(self, img, path_key_bin, key, func=0, verbose=False, use_rs=True, output_file="stego", greyscale=False):
+    def readCoefficients(self, img_name, greyscale=False):
+        # read the quantized DCT blocks straight out of the jpeg file rather than
+        # decoding to pixels and redoing blockify/DCT/quantize/zigzag.
+        # the file's own tables are swapped for ours, which is exact when the
+        # stego was written with them. returns (channels, blocks, 64) zig zag coefs
+        jpeg = jpeglib.read_dct(img_name)
+        if greyscale:
+            components = [jpeg.Y]
+        elif jpeg.has_chrominance:
+            components = [jpeg.Y, jpeg.Cb, jpeg.Cr]
+        else:
+            components = None
+        if components is None or self.BLOCK_SIZE != 8 or np.any(jpeg.samp_factor != jpeg.samp_factor[0]):
+            # subsampled chroma doesn't line up with our block grid
+            return self.computeCoefficients(img_name, greyscale)
+        self.img_height, self.img_width = jpeg.height, jpeg.width
+        self.ver_block_count = -(-self.img_height // self.BLOCK_SIZE)
+        self.hor_block_count = -(-self.img_width // self.BLOCK_SIZE)
+
+        # requantize a stripe of block rows at a time so the float copy stays
+        # small, the result lands in the int16 buffer we hand back
+        num_channels = len(components)
+        img = coefimage(num_channels, self.ver_block_count, self.hor_block_count, self.BLOCK_SIZE)
+        grid = img.grid()
+        zigzag, _ = getZigZag(self.BLOCK_SIZE)
+        table_shape = (num_channels, 1, 1, self.BLOCK_SIZE, self.BLOCK_SIZE)
+        file_tables = np.array([jpeg.qt[jpeg.quant_tbl_no[i]] for i in range(num_channels)]).reshape(table_shape)
+        tables = self.getQuantTableStack(num_channels).reshape(table_shape)
+        stripe_rows = self.STRIPE_ROWS or self.ver_block_count
+        for row_start in range(0, self.ver_block_count, stripe_rows):
+            row_end = min(row_start + stripe_rows, self.ver_block_count)
+            stripe = np.stack([c[row_start:row_end, :self.hor_block_count] for c in components]).astype(np.float64)
+            stripe *= file_tables
+            # jpeg level shifts pixels by -128 before its DCT, ours works on 0..255
+            stripe[..., 0, 0] += 128 * self.BLOCK_SIZE
+            stripe /= tables
+            stripe = np.rint(stripe).astype(np.int16)
+            grid[:, row_start:row_end] = stripe.reshape(stripe.shape[:3] + (self.BLOCK_SIZE*self.BLOCK_SIZE,))[..., zigzag]
+        return img
+
+    def computeCoefficients(self, img_name, greyscale=False):
+        # fallback for files we can't read in the coefficient domain: decode to
+        # pixels and run the forward pipeline again
+        from encoder import encoder
+        encoder_obj = encoder(self.BLOCK_SIZE, self.RS_PARAM, self.PRECISION, self.STRIPE_ROWS)
+        if not greyscale:
+            with open(img_name, "rb") as f:
+                jpg_img = simplejpeg.decode_jpeg(f.read(), 'BGR', False, False)
+        else:
+            jpg_img = cv2.imread(img_name, cv2.IMREAD_GRAYSCALE)
+        self.img_height, self.img_width = self.getImageDimensions(jpg_img)
+        encoder_obj.defineImgDim(self.img_height, self.img_width)
+        img = encoder_obj.transformStripes(jpg_img, greyscale)
+        self.ver_block_count, self.hor_block_count = img.ver_block_count, img.hor_block_count
+        return img
+
+    def decode(self, img, path_key_bin, key, func=0, verbose=False, use_rs=True, output_file="stego", greyscale=False, f5_k=1, path_file=True):
         print("jalan method decode")
+        if not path_file and (func not in (0, 3) or f5_k > 1):
+            # see encoder.encode, only these orders can be rebuilt from the key
+            raise ValueError('Only F5 and LSB can extract without a path file')
         if verbose:
-            with open(img, 'r') as f:
-                bitstring = f.read()
-
-            with open ('.imgdim', 'rb') as fp:
-                self.img_height, self.img_width = pickle.load(fp)
-
-            with open ('.v_imgdim', 'rb') as fp:
-                v_img_height, v_img_width = pickle.load(fp)
-            
-            self.hor_block_count = self.img_width // self.BLOCK_SIZE
-            self.ver_block_count = self.img_height // self.BLOCK_SIZE
-
-            hash_path = self.retrievePath(key,path_key_bin)
+            # the container is mapped rather than read, the stream is paged in
+            # as the huffman decoder reaches it
+            (v_img_height, v_img_width), num_channels, quant_tables, stream, restart_interval, segment_starts = readContainer(img)
+            self.Y_quant_table, self.C_quant_table = quant_tables[0], quant_tables[-1]
+            self.img_height, self.img_width = v_img_height, v_img_width
+            self.ver_block_count = -(-v_img_height // self.BLOCK_SIZE)
+            self.hor_block_count = -(-v_img_width // self.BLOCK_SIZE)
+            if path_file:
+                hash_path = self.retrievePath(key,path_key_bin)
             # extract data from Huffman encoding
-            Y_decoded_img, Cb_decoded_img, Cr_decoded_img = self.huffmanDecode(bitstring)
+            if restart_interval:
+                img = self.huffmanDecodeSegments(stream, num_channels, restart_interval, segment_starts)
+            else:
+                img = self.huffmanDecode(bitreader(stream), num_channels)
             print("finished decode")
 
-            img = self.unRLE([Y_decoded_img, Cb_decoded_img, Cr_decoded_img])
+            img = self.unRLE(img)
+            img = coefimage(len(img), self.ver_block_count, self.hor_block_count, self.BLOCK_SIZE, img)
             print("extracted zigzags")
 
-            if func == 0:
+            if not path_file:
+                # the order is rebuilt from the key, see encoder.encode
+                message = self.extractKeyed(img, key, func == 3)
+            elif func == 0:
                 msg_path = self.formatPathF5(hash_path)
-                message = self.extractF5(msg_path, img, False)
+                message = self.extractF5(msg_path, img, False, f5_k)
             elif func == 1:
                 msg_path = self.formatPath(hash_path, mode=1)
                 message = self.extractsdcsF5(msg_path, img)
@@ -754,6 +639,9 @@ class decoder:
             elif func == 3:
                 msg_path = self.formatPathF5(hash_path)
                 message = self.extractF5(msg_path, img, True)
+            elif func == 4:
+                msg_path = self.formatPath(hash_path, mode=1)
+                message = self.extractdrF5(msg_path, img)
             if use_rs:
                 rs_obj = rs(self.RS_PARAM)
                 polys = self.extractRSPoly(message)
@@ -768,75 +656,28 @@ class decoder:
                 message = self.extractMsgTxt(message)
                 print("non-rs extracted message:", message)
 
-            img = self.unDPCM(img)
+            img = self.unDPCM(img, restart_interval)
             print("extracted DC values from DPCM")
 
-            img = self.unZigZag(img)
-            print("restored 8x8 tiles")
-
-            img = self.deQuantize(img)
-            print("reversed quantization")
-
-            print("beginning dct...")
-            img = self.DCT_3(img)
-            print("performed inverse DCT")
+            img = self.renderStripes(img, v_img_height, v_img_width, num_channels == 1)
+            print("restored image from coefficients")
 
-            img = self.YCbCr2BGR(img)
-            print("converted YCbCr to BGR")
-
-            img = self.assembleImage(img)
-
-            if self.img_height != v_img_height:
-                img = self.removeVPadding(img, v_img_height)
-            if self.img_width != v_img_width:
-                img = self.removeHPadding(img, v_img_width)
             cv2.imwrite(output_file+'.png', img)
             print("done!")
         
         else:
-            from encoder import encoder
-            encoder_obj = encoder(self.BLOCK_SIZE, self.RS_PARAM)
-            encoder_obj.defineBlockCount(self.ver_block_count, self.hor_block_count)
-            if not greyscale:
-                with open(img, "rb") as f:
-                    jpg_img = simplejpeg.decode_jpeg(f.read(), 'BGR', False, False)
-                    jpg_img = cv2.cvtColor(jpg_img, cv2.COLOR_BGR2YCR_CB)
-            else:
-                jpg_img = cv2.imread(img, cv2.IMREAD_GRAYSCALE)
-            self.img_height, self.img_width = self.getImageDimensions(jpg_img)
-            encoder_obj.defineImgDim(self.img_height, self.img_width)
-            if self.img_width % self.BLOCK_SIZE != 0:
-                jpg_img = encoder_obj.padImageWidth(jpg_img)
-            if self.img_height % self.BLOCK_SIZE != 0:
-                jpg_img = encoder_obj.padImageHeight(jpg_img)
-            new_img_height, new_img_width = self.getImageDimensions(jpg_img)
-            self.hor_block_count, self.ver_block_count = new_img_width // self.BLOCK_SIZE, new_img_height // self.BLOCK_SIZE
-            total_blocks = self.ver_block_count * self.hor_block_count
-
-            if not greyscale:
-                Y_img, Cr_img, Cb_img = cv2.split(jpg_img)
-                img = encoder_obj.blockify([Y_img, Cb_img, Cr_img])
-            else:
-                img = encoder_obj.blockify([jpg_img])
-            print("Separated successfully")
-
-            print("beginning dct...")
-            img = encoder_obj.DCT_2(img)
-            print("finished dct")
+            img = self.readCoefficients(img, greyscale)
+            print("read quantized coefficients")
 
-            img = encoder_obj.quantizeAndRound(img)
-            print("finished quantization and round")
+            if path_file:
+                hash_path = self.retrievePath(key,path_key_bin)
 
-            img = encoder_obj.zigZagEncode(img)
-            print("finished zigzag")
-
-            img = [np.reshape(channel, (total_blocks, self.BLOCK_SIZE * self.BLOCK_SIZE)) for channel in img]
-
-            hash_path = self.retrievePath(key,path_key_bin)
-
-            if func == 0:
+            if not path_file:
+                # the order is rebuilt from the key, see encoder.encode
+                message = self.extractKeyed(img, key, func == 3)
+            elif func == 0:
                 msg_path = self.formatPathF5(hash_path)
-                message = self.extractF5(msg_path, img, False)
+                message = self.extractF5(msg_path, img, False, f5_k)
             elif func == 1:
                 msg_path = self.formatPath(hash_path, mode=1)
                 message = self.extractsdcsF5(msg_path, img)
@@ -846,6 +687,9 @@ class decoder:
             elif func == 3:
                 msg_path = self.formatPathF5(hash_path)
                 message = self.extractF5(msg_path, img, True)
+            elif func == 4:
+                msg_path = self.formatPath(hash_path, mode=1)
+                message = self.extractdrF5(msg_path, img)
             if use_rs:
                 rs_obj = rs(self.RS_PARAM)
                 polys = self.extractRSPoly(message)
@@ -862,6 +706,10 @@ class decoder:
             print("message extracted successfully")
             return message
 
+def decodeSegment(segment, num_channels, total_blocks, block_size):
+    # process pool entry point: huffman decode one restart segment
+    return decoder(block_size, 256).huffmanDecode(bitreader(segment), num_channels, total_blocks)
+
 ########################################
 ########PROGRAM BEGINS HERE#############
 ########################################
@@ -1,16 +1,22 @@
 import numpy as np
 import cv2
 import math
-import pickle
 from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
 import simplejpeg
+import jpeglib
 from random import randrange, choice
 from timeit import default_timer as timer
 
 from sdcs import sdcs
 from stc import stc
 from rs import rs
+from dct import dct
+from jpegtables import getZigZag, Y_QUANT_TABLE, C_QUANT_TABLE, DC_CODEWORDS, DC_CODEWORDS_INV, AC_CODEWORDS, AC_CODEWORDS_INV, DC_HUFF_CODES, DC_HUFF_LENGTHS, AC_HUFF_CODES, AC_HUFF_LENGTHS
+from coefimage import coefimage
+from bitstream import bitwriter
+from container import writeContainer
+from keyorder import keyedGenerator, lengthPrefix, LENGTH_BITS
 
 # to-do:
 # 1. enable program to work with any image dimension //done?
@@ -25,21 +31,33 @@ from rs import rs
 # as more letters will be included in an error-correcting chunk, reducing redundancy
 # overheads and increasing overall payload size.
 
-# Huffman tables for DC and AC values
-# yes they are massive, I think this is probably
-# the fastest and most sensible way to implement them
-# considering I have to pull the inverse too.
-
 class encoder:
-    def __init__(self, block_size, rs_param):
+    def __init__(self, block_size, rs_param, precision=np.float32, stripe_rows=32):
         self.TIME_LIMIT = 10
         self.BLOCK_SIZE = block_size
         self.RS_PARAM = rs_param
+        self.PRECISION = precision
+        # block rows pushed through the DCT at once, None for the whole image
+        self.STRIPE_ROWS = stripe_rows
+        # dmcss embeds in coefs with 0 < |coef| < TAU after recompression,
+        # sdcs works on (n, k, m) groups with coefficient vector a
+        self.TAU = 3
+        self.SDCS_PARAMS, self.SDCS_A = (3, 2, 17), [1, 2, 6]
+        # blocks F5 and LSB scan per step
+        self.F5_CHUNK = 4096
+        # margin the F5 capacity estimate leaves on the +-1 coefs
+        self.F5_SIGMAS = 4
+        # genQFactor results by (quality, table)
+        self.qfactor_tables = dict()
+        self.dct_obj = dct(block_size, precision)
         self.img_width, self.img_height = None, None
         self.hor_block_count, self.ver_block_count = None, None
-        self.Y_quant_table, self.C_quant_table = self.__getQuantTables()
-        self.dc_codeword_dict, self.dc_codeword_dict_inv = self.__getDCCodewordDicts()
-        self.ac_codeword_dict, self.ac_codeword_dict_inv = self.__getACCodewordDicts()
+        # constant tables are shared by every instance, see jpegtables
+        self.Y_quant_table, self.C_quant_table = Y_QUANT_TABLE, C_QUANT_TABLE
+        self.dc_codeword_dict, self.dc_codeword_dict_inv = DC_CODEWORDS, DC_CODEWORDS_INV
+        self.ac_codeword_dict, self.ac_codeword_dict_inv = AC_CODEWORDS, AC_CODEWORDS_INV
+        self.dc_huff_codes, self.dc_huff_lengths = DC_HUFF_CODES, DC_HUFF_LENGTHS
+        self.ac_huff_codes, self.ac_huff_lengths = AC_HUFF_CODES, AC_HUFF_LENGTHS
 
     def defineBlockCount(self, v, h):
         # helper function for when calling from main.py
@@ -59,246 +77,19 @@ class encoder:
         self.img_height, self.img_width = self.getImageDimensions(img)
         return img, greyscale
 
-    def __getDCCodewordDicts(self):
-        dc_codeword_dict = {
-            0: '00',
-            1: '010',
-            2: '011',
-            3: '100',
-            4: '101',
-            5: '110',
-            6: '1110',
-            7: '11110',
-            8: '111110',
-            9: '1111110',
-            10: '11111110',
-            11: '111111110'
-        }
-
-        dc_codeword_dict_inv = {codeword: cat for cat, codeword in dc_codeword_dict.items()}
-        return dc_codeword_dict, dc_codeword_dict_inv
-
-    def __getACCodewordDicts(self):
-        ac_codeword_dict = {
-            (0,0): '1010',
-            (0,1): '00',
-            (0,2): '01',
-            (0,3): '100',
-            (0,4): '1011',
-            (0,5): '11010',
-            (0,6): '1111000',
-            (0,7): '11111000',
-            (0,8): '1111110110',
-            (0,9): '1111111110000010',
-            (0,10): '1111111110000011',
-            (1,1): '1100',
-            (1,2): '11011',
-            (1,3): '1111001',
-            (1,4): '111110110',
-            (1,5): '11111110110',
-            (1,6): '1111111110000100',
-            (1,7): '1111111110000101',
-            (1,8): '1111111110000110',
-            (1,9): '1111111110000111',
-            (1,10): '1111111110001000',
-            (2,1): '11100',
-            (2,2): '11111001',
-            (2,3): '1111110111',
-            (2,4): '111111110100',
-            (2,5): '1111111110001001',
-            (2,6): '1111111110001010',
-            (2,7): '1111111110001011',
-            (2,8): '1111111110001100',
-            (2,9): '1111111110001101',
-            (2,10): '1111111110001110',
-            (3,1): '111010',
-            (3,2): '111110111',
-            (3,3): '111111110101',
-            (3,4): '1111111110001111',
-            (3,5): '1111111110010000',
-            (3,6): '1111111110010001',
-            (3,7): '1111111110010010',
-            (3,8): '1111111110010011',
-            (3,9): '1111111110010100',
-            (3,10): '1111111110010101',
-            (4,1): '111011',
-            (4,2): '1111111000',
-            (4,3): '1111111110010110',
-            (4,4): '1111111110010111',
-            (4,5): '1111111110011000',
-            (4,6): '1111111110011001',
-            (4,7): '1111111110011010',
-            (4,8): '1111111110011011',
-            (4,9): '1111111110011100',
-            (4,10): '1111111110011101',
-            (5,1): '1111010',
-            (5,2): '11111110111',
-            (5,3): '1111111110011110',
-            (5,4): '1111111110011111',
-            (5,5): '1111111110100000',
-            (5,6): '1111111110100001',
-            (5,7): '1111111110100010',
-            (5,8): '1111111110100011',
-            (5,9): '1111111110100100',
-            (5,10): '1111111110100101',
-            (6,1): '1111011',
-            (6,2): '111111110110',
-            (6,3): '1111111110100110',
-            (6,4): '1111111110100111',
-            (6,5): '1111111110101000',
-            (6,6): '1111111110101001',
-            (6,7): '1111111110101010',
-            (6,8): '1111111110101011',
-            (6,9): '1111111110101100',
-            (6,10): '1111111110101101',
-            (7,1): '11111010',
-            (7,2): '111111110111',
-            (7,3): '1111111110101110',
-            (7,4): '1111111110101111',
-            (7,5): '1111111110110000',
-            (7,6): '1111111110110001',
-            (7,7): '1111111110110010',
-            (7,8): '1111111110110011',
-            (7,9): '1111111110110100',
-            (7,10): '1111111110110101',
-            (8,1): '111111000',
-            (8,2): '111111111000000',
-            (8,3): '1111111110110110',
-            (8,4): '1111111110110111',
-            (8,5): '1111111110111000',
-            (8,6): '1111111110111001',
-            (8,7): '1111111110111010',
-            (8,8): '1111111110111011',
-            (8,9): '1111111110111100',
-            (8,10): '1111111110111101',
-            (9,1): '111111001',
-            (9,2): '1111111110111110',
-            (9,3): '1111111110111111',
-            (9,4): '1111111111000000',
-            (9,5): '1111111111000001',
-            (9,6): '1111111111000010',
-            (9,7): '1111111111000011',
-            (9,8): '1111111111000100',
-            (9,9): '1111111111000101',
-            (9,10): '1111111111000110',
-            (10,1): '111111010',
-            (10,2): '1111111111000111',
-            (10,3): '1111111111001000',
-            (10,4): '1111111111001001',
-            (10,5): '1111111111001010',
-            (10,6): '1111111111001011',
-            (10,7): '1111111111001100',
-            (10,8): '1111111111001101',
-            (10,9): '1111111111001110',
-            (10,10): '1111111111001111',
-            (11,1): '1111111001',
-            (11,2): '1111111111010000',
-            (11,3): '1111111111010001',
-            (11,4): '1111111111010010',
-            (11,5): '1111111111010011',
-            (11,6): '1111111111010100',
-            (11,7): '1111111111010101',
-            (11,8): '1111111111010110',
-            (11,9): '1111111111010111',
-            (11,10): '1111111111011000',
-            (12,1): '1111111010',
-            (12,2): '1111111111011001',
-            (12,3): '1111111111011010',
-            (12,4): '1111111111011011',
-            (12,5): '1111111111011100',
-            (12,6): '1111111111011101',
-            (12,7): '1111111111011110',
-            (12,8): '1111111111011111',
-            (12,9): '1111111111100000',
-            (12,10): '1111111111100001',
-            (13,1): '11111111000',
-            (13,2): '1111111111100010',
-            (13,3): '1111111111100011',
-            (13,4): '1111111111100100',
-            (13,5): '1111111111100101',
-            (13,6): '1111111111100110',
-            (13,7): '1111111111100111',
-            (13,8): '1111111111101000',
-            (13,9): '1111111111101001',
-            (13,10): '1111111111101010',
-            (14,1): '1111111111101011',
-            (14,2): '1111111111101100',
-            (14,3): '1111111111101101',
-            (14,4): '1111111111101110',
-            (14,5): '1111111111101111',
-            (14,6): '1111111111110000',
-            (14,7): '1111111111110001',
-            (14,8): '1111111111110010',
-            (14,9): '1111111111110011',
-            (14,10): '1111111111110100',
-            (15,1): '1111111111110101',
-            (15,2): '1111111111110110',
-            (15,3): '1111111111110111',
-            (15,4): '1111111111111000',
-            (15,5): '1111111111111001',
-            (15,6): '1111111111111010',
-            (15,7): '1111111111111011',
-            (15,8): '1111111111111100',
-            (15,9): '1111111111111101',
-            (15,10): '1111111111111110',
-            (15,0): '11111111001'
-        }
-
-        ac_codeword_dict_inv = {codeword: cat for cat, codeword in ac_codeword_dict.items()}
-
-        return ac_codeword_dict, ac_codeword_dict_inv
-
-    def __getQuantTables(self):
-        Y_quant_table = np.array([[
-            16, 11, 10, 16, 24, 40, 51, 61],
-        [12, 12, 14, 19, 26, 58, 60, 55],
-        [14, 13, 16, 24, 40, 57, 69, 56],
-        [14, 17, 22, 29, 51, 87, 80, 62],
-        [18, 22, 37, 56, 68, 109, 103, 77],
-        [24, 36, 55, 64, 81, 104, 113, 92],
-        [49, 64, 78, 87, 103, 121, 120, 101],
-        [72, 92, 95, 98, 112, 100, 103, 99
-        ]])
-
-        C_quant_table = np.array([[
-            17, 18, 24, 47, 99, 99, 99, 99],
-        [18, 21, 26, 66, 99, 99, 99, 99],
-        [24, 26, 56, 99, 99, 99, 99, 99],
-        [47, 66, 99, 99, 99, 99, 99, 99],
-        [99, 99, 99, 99, 99, 99, 99, 99],
-        [99, 99, 99, 99, 99, 99, 99, 99],
-        [99, 99, 99, 99, 99, 99, 99, 99],
-        [99, 99, 99, 99, 99, 99, 99, 99
-        ]])
-
-        return Y_quant_table, C_quant_table
-
     def getImageDimensions(self, img):
         # return image height, width as integers
         return img.shape[0], img.shape[1]
 
-    def padImageHeight(self, img):
-        # repeat last row of pixels until dimension is multiple of 8
-        while len(img) % self.BLOCK_SIZE != 0:
-            img = np.append(img, [img[len(img)-1]], axis=0)
-        return img
-
-    def padImageWidth(self, img):
-        # repeat last column of pixels until dimension is multiple of 8
-        img_list = list(img)
-        width = self.getImageDimensions(img)[1]
-        while width % self.BLOCK_SIZE != 0:
-            for row_index in range(len(img_list)):
-                row_list = list(img_list[row_index])
-                try:
-                    pixel_list = list(row_list[-1])
-                    row_list.append(pixel_list)
-                except:
-                    pixel_list = [row_list[-1]]
-                    row_list += pixel_list
-                img_list[row_index] = row_list
-            width += 1
-        return np.array(img_list)
+    def padImage(self, img):
+        # repeat last row and column of pixels until both dimensions are multiples of 8.
+        # both axes are padded by a single edge-mode np.pad, so this is one allocation
+        height, width = self.getImageDimensions(img)
+        pad_height, pad_width = -height % self.BLOCK_SIZE, -width % self.BLOCK_SIZE
+        if pad_height == 0 and pad_width == 0:
+            return img
+        padding = [(0, pad_height), (0, pad_width)] + [(0, 0)] * (img.ndim - 2)
+        return np.pad(img, padding, mode='edge')
 
     def displayImage(self, img):
         # show image in new window until key pressed
@@ -307,23 +98,15 @@ class encoder:
         cv2.destroyAllWindows()
 
     def blockify(self, img):
-        final_img = list()
-        for channel in img:
-            img_tiles = list() # transform image into series of 8x8 blocks
-            for row in range(0, self.img_height, self.BLOCK_SIZE):
-                img_tiles_row = list() # fill in row by row
-                for column in range(0, self.img_width, self.BLOCK_SIZE):
-                    column_end = column + self.BLOCK_SIZE
-                    row_end = row + self.BLOCK_SIZE
-                    # select the 8x8 tile
-                    tile = channel[row:row_end, column:column_end]
-                    # add it to the row array
-                    img_tiles_row.append(tile)
-                # append rows individually to the image matrix
-                # this ensure the dimensions are consistent
-                img_tiles.append(img_tiles_row)
-            final_img.append(np.array(img_tiles, dtype=np.float32))
-        return np.array(final_img)
+        # transform image into a (channels, rows, cols, 8, 8) grid of tiles.
+        # this is a strided view of the stacked channels - reshape splits each
+        # axis into (tile, pixel) and swapaxes moves the tile axes to the front,
+        # so no tile is ever copied on its own
+        img = np.asarray(img, dtype=np.float32)
+        num_channels, height, width = img.shape
+        rows, cols = height // self.BLOCK_SIZE, width // self.BLOCK_SIZE
+        img = img.reshape((num_channels, rows, self.BLOCK_SIZE, cols, self.BLOCK_SIZE))
+        return img.swapaxes(2, 3)
 
     def w(self, k_num):
         # for use in DCT transformation
@@ -333,176 +116,150 @@ class encoder:
             return 1
 
     def DCT_2(self, img):
-        # transform img into DCT coefficients
-        return np.array([np.array([np.array([cv2.dct(block) for block in row]) for row in channel]) for channel in img])
+        # transform img into DCT coefficients, all blocks of all channels in one batch
+        return self.dct_obj.forward(img)
+
+    def getQuantTableStack(self, num_channels):
+        # (channels, 8, 8) stack of tables: luma for channel 0, chroma for the rest
+        return np.array([self.Y_quant_table] + [self.C_quant_table] * (num_channels - 1))
 
     def quantizeAndRound(self, img):
-        # quantizes DCT coefs in-place using quant_table_2 atm (add quality options later)
-        # then rounds to nearest integer
-        final_img = list()
-        for i, channel in enumerate(img):
-            table = self.Y_quant_table if i == 0 else self.C_quant_table
-            final_img.append(np.array([np.rint(np.divide(block, table)) for block in np.array([row for row in channel])]))
-        return np.array(final_img)
+        # quantizes DCT coefs in-place, every block of every channel in one broadcast
+        # against the table stack, then rounds to nearest integer and stores as int16
+        tables = self.getQuantTableStack(len(img))
+        tables = tables.reshape((len(img),) + (1,) * (img.ndim - 3) + tables.shape[1:])
+        np.divide(img, tables, out=img)
+        np.rint(img, out=img)
+        return img.astype(np.int16)
 
     def zigZagEncode(self, img):
         # https://stackoverflow.com/questions/39440633/matrix-to-vector-with-python-numpy
-        # convert 8x8 block of dct coef's into a 64-len array via zig zag arrangement
-        return np.array([np.array([np.array([np.hstack([np.diagonal(block[::-1,:], k)[::(2*(k % 2)-1)] for k in range(1-block.shape[0], block.shape[0])]) for block in row]) for row in channel]) for channel in img])
+        # convert 8x8 blocks of dct coef's into 64-len arrays via zig zag arrangement,
+        # gathering every block through the precomputed permutation at once
+        zigzag, _ = getZigZag(self.BLOCK_SIZE)
+        img = np.asarray(img)
+        return img.reshape(img.shape[:-2] + (self.BLOCK_SIZE*self.BLOCK_SIZE,))[..., zigzag]
+
+    def transformStripes(self, img, greyscale):
+        # run the forward pipeline (colour convert, pad, blockify, DCT, quantize,
+        # zigzag) over horizontal stripes of block rows, writing each straight
+        # into a preallocated coefimage. only one stripe of float intermediates
+        # is alive at a time, so peak memory follows STRIPE_ROWS, not image size
+        ver_block_count = -(-self.img_height // self.BLOCK_SIZE)
+        hor_block_count = -(-self.img_width // self.BLOCK_SIZE)
+        coefs = coefimage(1 if greyscale else 3, ver_block_count, hor_block_count, self.BLOCK_SIZE)
+        grid = coefs.grid()
+        stripe_rows = self.STRIPE_ROWS or ver_block_count
+        for row_start in range(0, ver_block_count, stripe_rows):
+            row_end = min(row_start + stripe_rows, ver_block_count)
+            stripe = self.padImage(img[row_start*self.BLOCK_SIZE:row_end*self.BLOCK_SIZE])
+            if not greyscale:
+                stripe = cv2.cvtColor(stripe, cv2.COLOR_BGR2YCR_CB)
+                Y_img, Cr_img, Cb_img = cv2.split(stripe)
+                stripe = self.blockify([Y_img, Cb_img, Cr_img])
+            else:
+                stripe = self.blockify([stripe])
+            stripe = self.DCT_2(stripe)
+            stripe = self.quantizeAndRound(stripe)
+            grid[:, row_start:row_end] = self.zigZagEncode(stripe)
+        return coefs
 
-    def RLEandDPCM(self, zz_img):
+    def RLEandDPCM(self, zz_img, restart_interval=None):
         # create array of all DC values, encoded using DPCM - each value is the difference
-        # from the previous value rather than the actual value
-        # create array of RLE-encoded AC values - [skip, value]
-        # where skip is the number of zeroes preceeding value.
-        # [0,0] indicates the end of the block and is appended to the end
+        # from the previous block's value in raster order rather than the actual value
+        # create flat array of RLE-encoded AC values - [skip, value]
+        # where skip is the number of zeroes preceeding value. a run longer than 15
+        # is split with [15,0] entries, and [0,0] ends every block. both arrays are
+        # built for all blocks of a channel at once from the nonzero positions.
+        # with a restart interval the DC prediction starts over every
+        # restart_interval blocks, as each segment is decoded on its own
+        zz_img = np.asarray(zz_img)
+        zz_img = zz_img.reshape((len(zz_img), -1, zz_img.shape[-1]))
         final_img = list()
         for channel in zz_img:
-            dc_array, ac_arrays = list(), list()
-            zz_img_len = len(channel)
-            for row_block_i in range(zz_img_len):
-                row_len = len(channel[row_block_i])
-                for block_i in range(row_len):
-                    ac_rle = list()
-                    if block_i == 0 and row_block_i == 0:
-                        # encode the first DC value as-is
-                        dc_array.append(channel[row_block_i][block_i][0])
-                    else:
-                        # for the rest, encode the difference
-                        if block_i != 0:
-                            dc_array.append(channel[row_block_i][block_i][0] - channel[row_block_i][block_i-1][0])
-                        else:
-                            dc_array.append(channel[row_block_i][block_i][0] - channel[row_block_i-1][block_i-1][0])
-                    # start at 1 to skip the DC value
-                    ac_i = 1
-                    zero_count = 0
-                    # max zero count is to keep track of how many 16-0's there are
-                    # these should only be added to the ac_rle if there is a non-zero
-                    # coefficient after them. otherwise, [0,0] should follow the final
-                    # non-zero coefficient.
-                    max_zero_count = 0
-                    while ac_i < len(channel[row_block_i][block_i]):
-                        cur_num = channel[row_block_i][block_i][ac_i]
-                        if cur_num == 0:
-                            if zero_count == 15:
-                                max_zero_count += 1
-                                zero_count = 0
-                                ac_i += 1
-                                continue
-                            zero_count += 1
-                            ac_i += 1
-                            continue
-                        else:
-                            if max_zero_count > 0:
-                                for _ in range(max_zero_count):
-                                    ac_rle.append([15,0])
-                            ac_rle.append([zero_count, cur_num])
-                            zero_count = 0
-                            ac_i += 1
-                            continue
-                    # append end of block marker
-                    ac_rle.append([0,0])
-                    ac_arrays.append(ac_rle)
-            final_img += [np.array(dc_array), ac_arrays]
-        return np.array(final_img)
-
-    def categorize(self, coef):
-        # return category of coefficient (DC or AC) based on the table
-        # specified in the JPEG standard
-        if coef == 0:
-            return 0
-        elif coef == -1 or coef == 1:
-            return 1
-        elif coef in range(-3,-1) or coef in range(2,4):
-            return 2
-        elif coef in range(-7,-3) or coef in range(4,8):
-            return 3
-        elif coef in range(-15,-7) or coef in range(8,16):
-            return 4
-        elif coef in range(-31,-15) or coef in range(16,32):
-            return 5
-        elif coef in range(-63,-31) or coef in range(32,64):
-            return 6
-        elif coef in range(-127,-63) or coef in range(64,128):
-            return 7
-        elif coef in range(-255,-127) or coef in range(128,256):
-            return 8
-        elif coef in range(-511,-255) or coef in range(256,512):
-            return 9
-        elif coef in range(-1023,-511) or coef in range(512,1024):
-            return 10
-        elif coef in range(-2047,-1023) or coef in range(1024,2048):
-            return 11
-        elif coef in range(-4095,-2047) or coef in range(2048, 4096):
-            return 12
-        elif coef in range(-8191,-4095) or coef in range(4096, 8192):
-            return 13
-        elif coef in range(-16383,-8191) or coef in range(8192,16384):
-            return 14
-        elif coef in range(-32767,-16383) or coef in range(16384,32768):
-            return 15
-        elif coef == 32768:
-            return 16
+            total_blocks = len(channel)
+            # the first DC value is encoded as-is
+            dc_array = np.diff(channel[:, 0].astype(np.int32), prepend=0)
+            if restart_interval:
+                dc_array[::restart_interval] = channel[::restart_interval, 0]
+
+            block_nz, pos_nz = np.nonzero(channel[:, 1:])
+            # zeroes since the previous nonzero value of the same block
+            prev_pos = np.empty_like(pos_nz)
+            prev_pos[1:] = pos_nz[:-1]
+            first_in_block = np.ones(len(pos_nz), dtype=bool)
+            first_in_block[1:] = block_nz[1:] != block_nz[:-1]
+            prev_pos[first_in_block] = -1
+            zero_run = pos_nz - prev_pos - 1
+
+            # each nonzero takes one entry per [15,0] before it plus its own,
+            # and each block takes one more for the end of block marker
+            entry_count = zero_run // 16 + 1
+            entry_i = np.cumsum(entry_count) - 1 + block_nz
+            eob_i = np.cumsum(np.bincount(block_nz, weights=entry_count, minlength=total_blocks)).astype(np.int64)
+            eob_i += np.arange(total_blocks)
+            ac_array = np.zeros((int(entry_count.sum()) + total_blocks, 2), dtype=np.int32)
+            ac_array[:, 0] = 15
+            ac_array[entry_i, 0] = zero_run % 16
+            ac_array[entry_i, 1] = channel[block_nz, pos_nz + 1]
+            ac_array[eob_i] = 0
+            final_img += [dc_array, ac_array]
+        return final_img
+
+    def categorizeArray(self, coefs):
+        # categories and magnitude bits of a whole array of coefficients.
+        # frexp's exponent of |coef| is its bit length (0 for 0), and negative
+        # values get the one's complement of |coef| in category bits
+        coefs = np.asarray(coefs, dtype=np.int64)
+        _, categories = np.frexp(np.abs(coefs))
+        categories = categories.astype(np.int64)
+        magnitudes = np.where(coefs < 0, coefs + (1 << categories) - 1, coefs)
+        return categories, magnitudes
+
+    def huffman(self, img, restart_interval=None):
+        # entropy code the RLE/DPCM output into packed bytes.
+        # every coefficient is a single field - its codeword with the magnitude
+        # bits appended - computed for whole channels at once from the integer
+        # tables. blocks are interleaved across channels: Y, Cb, Cr of block 0,
+        # then block 1, and so on, so fields are ordered by (block, channel).
+        # with a restart interval, every restart_interval blocks the stream is
+        # byte aligned and an RSTn marker written, and the byte offset of each
+        # segment is returned along with the stream
+        dc_arrs, ac_arrs = img[0::2], img[1::2]
+        num_channels = len(dc_arrs)
+        codes, lengths, keys = list(), list(), list()
+        for channel_i, (dc_arr, ac_arr) in enumerate(zip(dc_arrs, ac_arrs)):
+            categories, magnitudes = self.categorizeArray(dc_arr)
+            codes.append((self.dc_huff_codes[categories] << categories) | magnitudes)
+            lengths.append(self.dc_huff_lengths[categories] + categories)
+            keys.append(np.arange(len(dc_arr)) * num_channels + channel_i)
+            # ac values are stored in pairs (skip, value), EOB and ZRL have
+            # category 0 so they get no magnitude bits
+            skips, values = np.asarray(ac_arr, dtype=np.int64).T
+            categories, magnitudes = self.categorizeArray(values)
+            codes.append((self.ac_huff_codes[skips, categories] << categories) | magnitudes)
+            lengths.append(self.ac_huff_lengths[skips, categories] + categories)
+            is_eob = (skips == 0) & (values == 0)
+            keys.append((np.cumsum(is_eob) - is_eob) * num_channels + channel_i)
+        # a stable sort keeps each block's DC ahead of its ACs
+        keys = np.concatenate(keys)
+        order = np.argsort(keys, kind='stable')
+        codes, lengths = np.concatenate(codes)[order], np.concatenate(lengths)[order]
+        writer = bitwriter()
+        segment_starts = [0]
+        if restart_interval:
+            # first field of every segment after the first
+            segment_blocks = restart_interval * num_channels
+            bounds = np.searchsorted(keys[order], np.arange(segment_blocks, keys.max() + 1, segment_blocks))
+            starts, ends = np.concatenate(([0], bounds)), np.concatenate((bounds, [len(codes)]))
+            for segment_i, (start, end) in enumerate(zip(starts, ends)):
+                if segment_i:
+                    writer.writeMarker(0xD0 + (segment_i - 1) % 8)
+                    segment_starts.append(len(writer.buffer))
+                writer.writeFields(codes[start:end], lengths[start:end])
         else:
-            return -1
-
-    def onesComp(self, bitstring):
-        oc_bitstring = ''
-        for char in bitstring:
-            if char == '1':
-                oc_bitstring += '0'
-            elif char == '0':
-                oc_bitstring += '1'
-        return oc_bitstring
-
-    def huffman(self, img):
-        # compute and create final bitstring of data
-        # dc and ac arrays should have same length, so can just use one
-        Y_dc_arr, Y_ac_arr, Cb_dc_arr, Cb_ac_arr, Cr_dc_arr, Cr_ac_arr = img
-        bitstring = ''
-        length = len(Y_dc_arr)
-        dc_arr, ac_arr = Y_dc_arr, Y_ac_arr # set default value to remove warnings
-        for index in range(length):
-            YCbCr_num = 0
-            while YCbCr_num < 3:
-                if YCbCr_num == 0:
-                    dc_arr, ac_arr = Y_dc_arr, Y_ac_arr
-                elif YCbCr_num == 1:
-                    dc_arr, ac_arr = Cb_dc_arr, Cb_ac_arr
-                elif YCbCr_num == 2:
-                    dc_arr, ac_arr = Cr_dc_arr, Cr_ac_arr
-                # find dc bit representation first
-                #print(dc_arr[index], YCbCr_num)
-                dc_category = self.categorize(dc_arr[index])
-                dc_codeword = self.dc_codeword_dict[dc_category]
-                # the [2:] is to remove the '0b' from the front of the binary string
-                dc_magnitude = bin(int(dc_arr[index]))[2:]
-                if int(dc_arr[index]) < 0:
-                    dc_magnitude = self.onesComp(dc_magnitude)
-                if dc_codeword != '00':
-                    dc_bitstring = dc_codeword + dc_magnitude
-                else:
-                    dc_bitstring = dc_codeword
-                bitstring += dc_bitstring
-                # now find all the ac bit reps
-                for ac_coef in ac_arr[index]:
-                    # ac values are stored in pairs (skip, value)
-                    # with skip being the number of zeroes, value being the
-                    # value of the next non-zero coefficient
-                    ac_skip = int(ac_coef[0])
-                    ac_value = int(ac_coef[1])
-                    ac_category = self.categorize(ac_value)
-                    ac_magnitude = bin(ac_value)[2:]
-                    if ac_value < 0:
-                        ac_magnitude = self.onesComp(ac_magnitude)
-                    ac_codeword = self.ac_codeword_dict[(ac_skip, ac_category)]
-                    if ac_codeword != '1010' and ac_codeword != '11111111001':
-                        ac_bitstring = ac_codeword + ac_magnitude
-                    else:
-                        ac_bitstring = ac_codeword
-                    bitstring += ac_bitstring
-                YCbCr_num += 1
-        return bitstring
+            writer.writeFields(codes, lengths)
+        return writer.flush(), segment_starts
 
     def messageConv(self, message):
         return ''.join([format(ord(x), '08b') for x in message])
@@ -510,6 +267,81 @@ class encoder:
     def findMaxPayload(self, img_height, img_width):
         return (img_height // self.BLOCK_SIZE * img_width // self.BLOCK_SIZE)
 
+    def dmcssMask(self, img):
+        # (channels, blocks, 64) mask of the coefs dmcss can use: those with
+        # 0 < |coef| < TAU once the block is recompressed at quality 60.
+        # the test only depends on |coef| and holds for one interval of it, so
+        # it's worked out per (channel, coef) for every magnitude the image has
+        # and the coefs are then checked against those bounds in one broadcast
+        tables = self.getQuantTableStack(len(img)).reshape((len(img), -1))
+        qcomp = self.genQFactor(60, tables)
+        abs_coefs = np.abs(img.coefs)
+        magnitudes = np.arange(int(abs_coefs.max()) + 1)
+        comp = np.abs(np.rint(np.divide(np.multiply(magnitudes, tables[..., None]), qcomp[..., None])))
+        usable = (0 < comp) & (comp < self.TAU)
+        lo = np.where(usable.any(axis=-1), np.argmax(usable, axis=-1), len(magnitudes))
+        hi = len(magnitudes) - 1 - np.argmax(usable[..., ::-1], axis=-1)
+        lo[:, 0] = len(magnitudes) # ignore dc coef
+        return (lo[:, None] <= abs_coefs) & (abs_coefs <= hi[:, None])
+
+    def embeddingCapacity(self, img, func=0, f5_k=1):
+        # bits of (possibly RS coded) payload each algorithm can embed in the
+        # coefimage img, from coefficient counts over all blocks at once
+        ac = img.coefs[..., 1:]
+        if func == 0:
+            # F5 gets a bit from every |coef| > 1, and from a coef of +-1 only
+            # when its lsb already matches, since the others shrink to 0 and are
+            # skipped. that's a coin flip per coef, so rather than the average
+            # of half of them take F5_SIGMAS standard deviations below it: a
+            # payload at the estimate then fits bar about 3 in 100000 embeddings.
+            # matrix encoding puts f5_k bits in every 2^f5_k-1 of those
+            ones = np.count_nonzero(np.abs(ac) == 1)
+            matched = max(ones / 2 - self.F5_SIGMAS * math.sqrt(ones) / 2, 0)
+            return int(np.count_nonzero(ac) - ones + matched) * f5_k // (2**f5_k - 1)
+        elif func == 1:
+            # every n suitable coefs in a block carry one z_m integer
+            (n, k, m), _ = self.SDCS_PARAMS, self.SDCS_A
+            suitable = np.count_nonzero((0 < ac) & (ac < m - 1), axis=-1)
+            return int(np.sum(suitable // n)) * math.floor(math.log(m, 2))
+        elif func == 2:
+            # syndrome coding uses two coefs per bit
+            return int(np.count_nonzero(self.dmcssMask(img))) // 2
+        elif func == 3:
+            return int(np.count_nonzero(ac))
+        elif func == 4:
+            # every block with at least 8 nonzero AC coefs holds one bit per two of them
+            nonzero = np.count_nonzero(ac, axis=-1)
+            return int(np.sum(nonzero[nonzero >= 8] // 2))
+        else:
+            raise ValueError('Algorithm must be:\n0: F5\n1: SDCS F5\n2: optimDMCSS\n3: LSB\n4: drF5')
+
+    def messageCapacity(self, capacity, use_rs=True):
+        # message bits (whole characters) that fit in capacity payload bits.
+        # with RS every K message bytes cost an N byte codeword, and a short
+        # last chunk still carries the full N-K parity bytes
+        capacity_bytes = capacity // 8
+        if use_rs:
+            rs_obj = rs(self.RS_PARAM)
+            full_polys, rest = divmod(capacity_bytes, rs_obj.N)
+            capacity_bytes = full_polys * rs_obj.K + max(rest - (rs_obj.N - rs_obj.K), 0)
+        return 8 * capacity_bytes
+
+    def estimateCapacity(self, img_name, func=0, use_rs=True, f5_k=1, path_file=True):
+        # dry run: how many message bits encode() could hide in img_name with
+        # algorithm func. nothing is embedded or written, but the cover still
+        # goes through the same striped forward DCT as encode, since that's what
+        # the counts have to match - about half the time of an F5 encode, a
+        # second or so for a 12 MP cover. without a path file the payload also
+        # carries its length in front
+        if not path_file and (func not in (0, 3) or f5_k > 1):
+            raise ValueError('Only F5 and LSB can embed without a path file')
+        img, greyscale = self.__readImage(img_name)
+        img = self.transformStripes(img, greyscale)
+        capacity = self.embeddingCapacity(img, func, f5_k)
+        if not path_file:
+            capacity = max(capacity - LENGTH_BITS, 0)
+        return self.messageCapacity(capacity, use_rs)
+
     def lsbF5(self, x):
         if x < 0:
             return int((1 - x) % 2)
@@ -517,93 +349,102 @@ class encoder:
             return int(x % 2)
 
     def sdcsF5(self, msg, img):
-        hash_path = ''
-        num_channels = img.shape[0]
+        # groups of n consecutive coefs with 0 < coef < m-1 in each block, in
+        # raster block order, each group carrying one z_m integer. the groups
+        # come from a whole-image mask and get embedded together
+        num_channels = len(img)
         # set up sdcs
-        n, k, m, a = 3, 2, 17, [1,2,6]
+        (n, k, m), a = self.SDCS_PARAMS, self.SDCS_A
         f5_sdcs = sdcs((n,k,m), a)
         # convert message to correct format for sdcs - blocks of n z_m integers
         num_bits_per_int = math.floor(math.log(m, 2))
-        b_arr = list()
-        for i in range(0, len(msg), num_bits_per_int):
-            bits = msg[i:i+num_bits_per_int]
-            b_arr.append(int(bits,2))
+        b_arr = np.array([int(msg[i:i+num_bits_per_int], 2) for i in range(0, len(msg), num_bits_per_int)], dtype=np.int64)
         # what to do with left-over vals if it doesnt divide equally into n coefs?
-        # begin embedding
-        path = list()
-        b_i = 0
-        block_perms = np.arange(num_channels * self.ver_block_count * self.hor_block_count)
-        for block_num in block_perms:
-            channel_i = block_num // (self.ver_block_count * self.hor_block_count)
-            row_i = (block_num % (self.ver_block_count * self.hor_block_count)) // self.hor_block_count
-            block_i = (block_num % (self.ver_block_count * self.hor_block_count)) % self.hor_block_count
-            channel = img[channel_i]
-            suitable_coefs_boolmask = np.array([0<coef<(m-1) for coef in channel[row_i][block_i]]) # true or false based on value
-            suitable_coefs_boolmask[0] = False # avoid DC values
-            suitable_coefs = np.extract(suitable_coefs_boolmask, channel[row_i][block_i]) # filter array by value
-            suitable_coefs_index = np.where(suitable_coefs_boolmask==True)[0] # get indexes of those filtered
-            if len(suitable_coefs) < n: # if there arent enough suitable coefficients
-                continue
-            for j in range(0, len(suitable_coefs), n):
-                coefs_i = suitable_coefs_index[j:j+n]
-                coefs = suitable_coefs[j:j+n] # what we have,
-                if len(coefs) < n:
-                    continue
-                b = b_arr[b_i] # what we want,
-                delta = f5_sdcs.embed(coefs, b) # how we change what we have to get what we want
-                block_path = list()
-                for i, coef_index in enumerate(coefs_i): # make the changes:
-                    channel[row_i][block_i][coef_index] += delta[i]
-                    block_path.append(coef_index)
-                if len(block_path) != 0:
-                    global_block = (row_i * self.hor_block_count) + block_i
-                    hash_path += ''.join(['0', str(channel_i), str(global_block).zfill(len(str(self.ver_block_count*self.hor_block_count)))] + [str(x).zfill(2) for x in block_path] + ['0','0'])
-                    path.append([channel_i, row_i, block_i, block_path])
-                    b_i += 1
-                    if b_i >= len(b_arr):
-                        return hash_path, img
-        raise Exception('Message is too long!')
-
-    def compress(self, block, qm, t):
-        return np.rint(np.divide(cv2.dct(np.rint(cv2.idct(np.multiply(block, qm[t-1])))), qm[t]))
+        flat_img = img.coefs.reshape((num_channels * img.total_blocks, -1))
+        mask = (0 < flat_img) & (flat_img < m-1)
+        mask[:, 0] = False # avoid DC values
+        block_nums, coefs_i = np.nonzero(mask)
+        # leftover coefs of a block that don't fill a group are skipped
+        counts = np.count_nonzero(mask, axis=1)
+        rank = np.arange(len(block_nums)) - (np.cumsum(counts) - counts)[block_nums]
+        keep = rank < (counts // n * n)[block_nums]
+        coefs_i = coefs_i[keep].reshape((-1, n))
+        block_nums = block_nums[keep][::n]
+        if len(block_nums) < len(b_arr):
+            raise Exception('Message is too long!')
+        coefs_i, block_nums = coefs_i[:len(b_arr)], block_nums[:len(b_arr)]
+        hosts = flat_img[block_nums[:, None], coefs_i]
+        flat_img[block_nums[:, None], coefs_i] = hosts + f5_sdcs.embed(hosts, b_arr) # how we change what we have to get what we want
+        int_format = len(str(self.ver_block_count*self.hor_block_count))
+        if int_format % 2 != 0: int_format += 1
+        hash_path = ''.join(['0' + str(block_num // img.total_blocks) + str(block_num % img.total_blocks).zfill(int_format)
+                             + ''.join([str(x).zfill(2) for x in block_path]) + '00'
+                             for block_num, block_path in zip(block_nums.tolist(), coefs_i.tolist())])
+        return hash_path, img
 
     def genQFactor(self, q, m):
-        s = 5000/q if q < 50 else 200-2*q
-        op = lambda x: np.floor((s * x + 50)/100)
-        return np.array([op(x) for x in m])
-
-    def ditherAdjust(self, block, Y_flag, k=1, T=1, n=30):
+        # table m, or a stack of tables, scaled to quality q. the results are
+        # kept per (quality, table) as dmcss asks for the same few over and over
+        m = np.asarray(m)
+        key = (q, m.shape, m.tobytes())
+        if key not in self.qfactor_tables:
+            s = 5000/q if q < 50 else 200-2*q
+            table = np.floor((s * m + 50)/100)
+            table.flags.writeable = False
+            self.qfactor_tables[key] = table
+        return self.qfactor_tables[key]
+
+    def ditherAdjust(self, img, protect, n=4):
         # do not dither dc coefs
         # https://www.sciencedirect.com/science/article/pii/S0165168420300013
-        qm = list()
-        if Y_flag:
-            for q in range(90, 90-n-1, -1):
-                qm.append(self.genQFactor(q, self.Y_quant_table))
-        else:
-            for q in range(90, 90-n-1, -1):
-                qm.append(self.genQFactor(q, self.C_quant_table))
-        qm = np.array(qm)
-        block_original = block.copy()
-
-        for t in range(1, n):
-            block_tilde = block.copy()
-            while True:
-                if k > T:
-                    break
-                block = self.compress(block, qm, t)
-                mod_ind = np.where(block % 2 != block_tilde % 2)
-                if len(mod_ind[0]) and len(mod_ind[1]) == 0:
-                    break
-                for row_ind, col_ind in np.dstack(mod_ind)[0]:
-                    if row_ind == 0 and col_ind == 0:
-                        continue
-                    if block[row_ind][col_ind] == block_original[row_ind][col_ind] + 1:
-                        block[row_ind][col_ind] -= 2*k
-                    elif block[row_ind][col_ind] == block_original[row_ind][col_ind] - 1:
-                        block[row_ind][col_ind] += 2*k
-                k += 1
-            #block = np.divide(block, qm[t])
-        return block
+        # protect flags the coefs of img whose parity has to survive the file
+        # being decoded to 8-bit pixels and compressed again. each pass takes
+        # every block position holding a protected coef, with all its channels,
+        # through the same round trip as decoder.renderStripes and
+        # transformStripes, and moves every protected coef that came back with
+        # the other parity 2 further the way it drifted. that keeps its own
+        # parity and puts it clear of the rounding that flipped it. stops once
+        # nothing flips or after n passes
+        from decoder import decoder
+        decoder_obj = decoder(self.BLOCK_SIZE, self.RS_PARAM, self.PRECISION, self.STRIPE_ROWS)
+        _, unzigzag = getZigZag(self.BLOCK_SIZE)
+        num_channels = len(img)
+        protect = np.array(protect, dtype=bool)
+        protect[..., 0] = False
+        blocks = np.flatnonzero(protect.any(axis=(0, 2)))
+        protect = protect[:, blocks]
+        # the colour conversion is per pixel, so the blocks don't interact. the
+        # edge padding of the last block row and column is redone from the
+        # block's own pixels, as transformStripes pads from the visible edge
+        row_i, block_i = img.blockRowCol(blocks)
+        pad_rows = np.where(row_i == img.ver_block_count - 1, -self.img_height % self.BLOCK_SIZE, 0)
+        pad_cols = np.where(block_i == img.hor_block_count - 1, -self.img_width % self.BLOCK_SIZE, 0)
+        for _ in range(n):
+            coefs = img.coefs[:, blocks]
+            pixels = decoder_obj.DCT_3(decoder_obj.deQuantize(coefs[..., unzigzag].reshape(coefs.shape[:2] + (self.BLOCK_SIZE, self.BLOCK_SIZE))))
+            pixels = np.moveaxis(pixels, 0, -1)
+            if num_channels == 3:
+                pixels = decoder_obj.YCbCr2BGR(pixels)
+            pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+            for pad in np.unique(pad_rows[pad_rows > 0]):
+                pixels[pad_rows == pad, self.BLOCK_SIZE-pad:] = pixels[pad_rows == pad, self.BLOCK_SIZE-pad-1:self.BLOCK_SIZE-pad]
+            for pad in np.unique(pad_cols[pad_cols > 0]):
+                pixels[pad_cols == pad, :, self.BLOCK_SIZE-pad:] = pixels[pad_cols == pad, :, self.BLOCK_SIZE-pad-1:self.BLOCK_SIZE-pad]
+            if num_channels == 3:
+                # blocks stacked into one column of pixels for cvtColor
+                pixels = cv2.cvtColor(pixels.reshape((-1, self.BLOCK_SIZE, 3)), cv2.COLOR_BGR2YCR_CB)
+                Y_img, Cr_img, Cb_img = cv2.split(pixels)
+                pixels = [Y_img, Cb_img, Cr_img]
+            else:
+                pixels = [pixels[..., 0]]
+            pixels = np.asarray(pixels, dtype=np.float32).reshape(coefs.shape[:2] + (self.BLOCK_SIZE, self.BLOCK_SIZE))
+            recompressed = self.zigZagEncode(self.quantizeAndRound(self.DCT_2(pixels)))
+            mod = protect & (recompressed % 2 != coefs % 2)
+            if not mod.any():
+                break
+            coefs[mod] += 2 * np.sign(recompressed[mod] - coefs[mod])
+            img.coefs[:, blocks] = coefs
+        return img
 
     def diffMancEnc(self, a):
         map_sign = lambda x: 1 if math.copysign(1, x) == 1 else 0
@@ -617,83 +458,73 @@ class encoder:
 
     def optimDMCSS(self, msg, img):
         rs_obj = rs(256)
-        TAU = 3
-        num_channels = img.shape[0]
+        num_channels = len(img)
         hash_path = ''
-        path = list()
-        avail_coefs = list()
-        poly_coefs = list()
         H_hat = np.array([71,109], dtype=np.uint8)
         stc_obj = stc(H_hat)
         map_sign = lambda x: 1 if math.copysign(1, x) == 1 else 0
         block_perms = np.random.permutation(np.arange(num_channels * self.ver_block_count * self.hor_block_count))
         int_format = len(str(self.ver_block_count*self.hor_block_count))
         if int_format % 2 != 0: int_format += 1
-        for block_num in block_perms:
-            if len(avail_coefs) >= 2 * len(msg):
-                avail_coefs = avail_coefs[:2*len(msg)]
-                poly_coefs = list(np.absolute(poly_coefs[:2*len(msg)]))
-                m = np.array(list(msg), dtype=np.int_) # change if break np.uint8
-                y, _ = stc_obj.generate(avail_coefs,m)
-                y_polys = [rs_obj.encodeMsg(poly_coefs[j:j+rs_obj.K]).astype(np.int_) for j in range(0, len(poly_coefs), rs_obj.K)]
-                parity_nums = list()
-                bin_msg = ''
-                for poly in y_polys:
-                    parity_nums += list(poly[len(poly)-(rs_obj.N-rs_obj.K):])
-                    poly = poly[:-(rs_obj.N-rs_obj.K)]
-                    bin_poly = [format(num, '08b') for num in np.array(poly, dtype=np.uint8)]
-                    bin_msg += ''.join([bit for bit in bin_poly])
-                final_x = list()
-                actual_i, effective_i = 0, 0
-                while actual_i < len(path):
-                    channel_i, row_i, block_i, coefs_ind = path[actual_i]
-                    for coef_ind in coefs_ind:
-                        if effective_i >= len(y):
-                            path = path[:actual_i+1]
-                            path[actual_i][3] = path[actual_i][3][:effective_i]
-                            break
-                        coef = img[channel_i][row_i][block_i][coef_ind]
-                        img[channel_i][row_i][block_i][coef_ind] *= (-1)**(map_sign(coef) - y[effective_i])
-                        final_x.append(img[channel_i][row_i][block_i][coef_ind])
-                        effective_i += 1
-                    actual_i += 1
-                diff_manc = self.diffMancEnc(final_x)+1
-                actual_i, effective_i = 0, 0
-                while actual_i < len(path):
-                    channel_i, row_i, block_i, coefs_ind = path[actual_i]
-                    block_path = list()
-                    for j, x in enumerate(coefs_ind):
-                        if j+effective_i >= len(diff_manc):
-                            break
-                        block_path.append([x, diff_manc[j+effective_i]])
-                    global_block = (row_i * self.hor_block_count) + block_i
-                    hash_path += ''.join(['0', str(channel_i), str(global_block).zfill(int_format)] + [str(x).zfill(2) + str(y).zfill(2) for x, y in block_path] + ['0','0'])            
-                    effective_i += len(coefs_ind)
-                    actual_i += 1
-                parity_nums = ''.join([str(x).zfill(4) for x in parity_nums])
-                hash_path += 'PB'+parity_nums
-                return hash_path, img
-            channel_i = block_num // (self.ver_block_count * self.hor_block_count)
-            row_i = (block_num % (self.ver_block_count * self.hor_block_count)) // self.hor_block_count
-            block_i = (block_num % (self.ver_block_count * self.hor_block_count)) % self.hor_block_count
-            channel = img[channel_i]
-            qcomp = self.genQFactor(60, self.Y_quant_table if channel_i == 0 else self.C_quant_table)
-            block = channel[row_i][block_i]
-            # compress block
-            comp_block = np.rint(np.divide(np.multiply(block.copy().reshape((self.BLOCK_SIZE,self.BLOCK_SIZE)), self.Y_quant_table if channel_i == 0 else self.C_quant_table), qcomp)).reshape((self.BLOCK_SIZE*self.BLOCK_SIZE))
-            coef_mask = np.array([0 < abs(coef) < TAU for coef in comp_block])
-            coef_mask[0] = False # ignore dc coef
-            coefs = np.extract(coef_mask, block)
-            coefs_ind = np.where(coef_mask == True)[0]
-            poly_coefs += list(coefs)
-            avail_coefs += [map_sign(x) for x in coefs]
-            path.append([channel_i, row_i, block_i, list(coefs_ind)])
-        raise Exception('Message too long!')
+        # blocks are taken in permutation order until they hold two usable coefs
+        # per message bit, the usable coefs coming from the whole image mask
+        mask = self.dmcssMask(img).reshape((len(block_perms), -1))
+        num_blocks = int(np.searchsorted(np.cumsum(np.count_nonzero(mask[block_perms], axis=1)), 2 * len(msg))) + 1
+        if num_blocks > len(block_perms):
+            raise Exception('Message too long!')
+        used = block_perms[:num_blocks]
+        perm_i, coefs_ind = np.nonzero(mask[used])
+        coefs = img.coefs.reshape((len(block_perms), -1))[used[perm_i], coefs_ind]
+        channels, rows, cols = img.splitIndex(used)
+        block_starts = np.searchsorted(perm_i, np.arange(num_blocks))
+        path = [[channel_i, row_i, block_i, block_ind] for channel_i, row_i, block_i, block_ind
+                in zip(channels.tolist(), rows.tolist(), cols.tolist(), np.split(coefs_ind, block_starts[1:]))]
+        avail_coefs = (coefs[:2*len(msg)] > 0).astype(np.int_).tolist()
+        poly_coefs = list(np.absolute(coefs[:2*len(msg)]))
+        m = np.array(list(msg), dtype=np.int_) # change if break np.uint8
+        y, _ = stc_obj.generate(avail_coefs,m)
+        y_polys = [rs_obj.encodeMsg(poly_coefs[j:j+rs_obj.K]).astype(np.int_) for j in range(0, len(poly_coefs), rs_obj.K)]
+        parity_nums = list()
+        bin_msg = ''
+        for poly in y_polys:
+            parity_nums += list(poly[len(poly)-(rs_obj.N-rs_obj.K):])
+            poly = poly[:-(rs_obj.N-rs_obj.K)]
+            bin_poly = [format(num, '08b') for num in np.array(poly, dtype=np.uint8)]
+            bin_msg += ''.join([bit for bit in bin_poly])
+        final_x = list()
+        actual_i, effective_i = 0, 0
+        while actual_i < len(path):
+            channel_i, row_i, block_i, coefs_ind = path[actual_i]
+            block = img[channel_i, img.blockIndex(row_i, block_i)]
+            for coef_ind in coefs_ind:
+                if effective_i >= len(y):
+                    path = path[:actual_i+1]
+                    path[actual_i][3] = path[actual_i][3][:effective_i]
+                    break
+                block[coef_ind] *= (-1)**(map_sign(block[coef_ind]) - y[effective_i])
+                final_x.append(block[coef_ind])
+                effective_i += 1
+            actual_i += 1
+        diff_manc = self.diffMancEnc(final_x)+1
+        actual_i, effective_i = 0, 0
+        while actual_i < len(path):
+            channel_i, row_i, block_i, coefs_ind = path[actual_i]
+            block_path = list()
+            for j, x in enumerate(coefs_ind):
+                if j+effective_i >= len(diff_manc):
+                    break
+                block_path.append([x, diff_manc[j+effective_i]])
+            global_block = img.blockIndex(row_i, block_i)
+            hash_path += ''.join(['0', str(channel_i), str(global_block).zfill(int_format)] + [str(x).zfill(2) + str(y).zfill(2) for x, y in block_path] + ['0','0'])            
+            effective_i += len(coefs_ind)
+            actual_i += 1
+        parity_nums = ''.join([str(x).zfill(4) for x in parity_nums])
+        hash_path += 'PB'+parity_nums
+        return hash_path, img
 
     def dmcss(self, msg, img):
         # do stc at end after gathering all coefs + locations?
-        TAU = 3
-        num_channels = img.shape[0]
+        num_channels = len(img)
         msg_i = 0
         hash_path = ''
         path = list()
@@ -701,24 +532,17 @@ class encoder:
         stc_obj = stc(H_hat)
         map_sign = lambda x: 1 if math.copysign(1, x) == 1 else 0
         block_perms = np.random.permutation(np.arange(num_channels * self.ver_block_count * self.hor_block_count))
-        for block_num in block_perms:
+        # only blocks with at least 8 usable coefs take part, in permutation order
+        mask = self.dmcssMask(img).reshape((len(block_perms), -1))
+        block_perms = block_perms[np.count_nonzero(mask[block_perms], axis=1) >= 8]
+        flat_img = img.coefs.reshape((len(mask), -1))
+        for block_num in block_perms.tolist():
             if msg_i >= len(msg):
                 return hash_path, img
-            channel_i = block_num // (self.ver_block_count * self.hor_block_count)
-            row_i = (block_num % (self.ver_block_count * self.hor_block_count)) // self.hor_block_count
-            block_i = (block_num % (self.ver_block_count * self.hor_block_count)) % self.hor_block_count
-            channel = img[channel_i]
-            qcomp = self.genQFactor(60, self.Y_quant_table if channel_i == 0 else self.C_quant_table)
-            block = channel[row_i][block_i]
-            # compress block
-            comp_block = np.rint(np.divide(np.multiply(block.copy().reshape((self.BLOCK_SIZE,self.BLOCK_SIZE)), self.Y_quant_table if channel_i == 0 else self.C_quant_table), qcomp)).reshape((self.BLOCK_SIZE*self.BLOCK_SIZE))
-            coef_mask = np.array([0 < abs(coef) < TAU for coef in comp_block])
-            coef_mask[0] = False # ignore dc coef
-            coefs = np.extract(coef_mask, block)
-            if len(coefs) < 8:
-                continue
-            coefs_ind = np.where(coef_mask == True)[0]
-            x = [map_sign(x) for x in coefs]
+            channel_i, row_i, block_i = img.splitIndex(block_num)
+            block = flat_img[block_num]
+            coefs_ind = np.flatnonzero(mask[block_num])
+            x = (block[coefs_ind] > 0).astype(np.int_).tolist()
             if msg_i + len(x) // 2 < len(msg):
                 m = msg[msg_i:(msg_i + len(x)//2)]
             else:
@@ -737,121 +561,233 @@ class encoder:
             path.append([channel_i, row_i, block_i, block_path])
             int_format = len(str(self.ver_block_count*self.hor_block_count))
             if int_format % 2 != 0: int_format += 1
-            global_block = (row_i * self.hor_block_count) + block_i
+            global_block = img.blockIndex(row_i, block_i)
             hash_path += ''.join(['0', str(channel_i), str(global_block).zfill(len(str(self.ver_block_count*self.hor_block_count)))] + [str(x).zfill(2) + str(y).zfill(2) for x, y in block_path] + ['0','0'])
+        if msg_i >= len(msg):
+            return hash_path, img
         raise Exception('Message too long!')
 
     def drF5(self, msg, img):
+        # stc over the lsbs of the nonzero AC coefs of every block that has at
+        # least 8 of them, in a random block order. the last block only uses
+        # the coefs its bits need, so extraction gets no trailing bits
         hash_path = ''
-        path = list()
         msg_i = 0
-        num_channels = img.shape[0]
+        num_channels = len(img)
         block_perms = np.random.permutation(np.arange(num_channels * self.ver_block_count * self.hor_block_count))
         H_hat = np.array([71,109], dtype=np.uint8)
         stc_obj = stc(H_hat)
-        for block_num in block_perms:
+        flat_img = img.coefs.reshape((len(block_perms), -1))
+        mask = flat_img != 0
+        mask[:, 0] = False # ignore dc coef
+        block_perms = block_perms[np.count_nonzero(mask[block_perms], axis=1) >= 8]
+        int_format = len(str(self.ver_block_count*self.hor_block_count))
+        if int_format % 2 != 0: int_format += 1
+        protect = np.zeros(flat_img.shape, dtype=bool)
+        for block_num in block_perms.tolist():
             if msg_i >= len(msg):
-                return hash_path, img
-            channel_i = block_num // (self.ver_block_count * self.hor_block_count)
-            row_i = (block_num % (self.ver_block_count * self.hor_block_count)) // self.hor_block_count
-            block_i = (block_num % (self.ver_block_count * self.hor_block_count)) % self.hor_block_count
-            channel = img[channel_i]
-            block = channel[row_i][block_i]
-            coef_mask = np.array([abs(coef) > 0 for coef in block])
-            coef_mask[0] = False # ignore dc coef
-            coefs = np.extract(coef_mask, block)
-            if len(coefs) < 8:
-                continue
-            coefs_ind = np.where(coef_mask == True)[0]
-            x = [int(x%2) for x in coefs]
-            if msg_i + len(x) // 2 < len(msg):
-                m = msg[msg_i:(msg_i + len(x)//2)]
-            else:
-                m = msg[msg_i:]
-            m = np.array(list(m), dtype=np.uint8)
-            msg_i += len(x) // 2
-            y, _ = stc_obj.generate(x,m)
-            block_path = list()
-            for y_i, coef_i in enumerate(coefs_ind):
-                block[coef_i] += y[y_i] - block[coef_i]%2
-                block_path.append(coef_i) #row, coef
-            # we now have an stc encoded block, so we must now perform the dither adjustment
-            block = self.ditherAdjust(block.reshape((8,8)), True if channel_i == 0 else False)
-            path.append([channel_i, row_i, block_i, block_path])
-            int_format = len(str(self.ver_block_count*self.hor_block_count))
-            if int_format % 2 != 0: int_format += 1
-            global_block = (row_i * self.hor_block_count) + block_i
-            hash_path += ''.join(['0', str(channel_i), str(global_block).zfill(len(str(self.ver_block_count*self.hor_block_count)))] + [str(x).zfill(2) for x in block_path] + ['0','0'])
-        raise Exception('Message too long!')
-
-    def F5(self, msg, img):
-        num_channels = img.shape[0]
-        # c1, c2, c3 = y,cb,cr
+                break
+            channel_i, row_i, block_i = img.splitIndex(block_num)
+            block = flat_img[block_num]
+            coefs_ind = np.flatnonzero(mask[block_num])
+            m = msg[msg_i:msg_i + len(coefs_ind)//2]
+            msg_i += len(m)
+            coefs_ind = coefs_ind[:2*len(m)]
+            x = (block[coefs_ind] % 2).tolist()
+            y, _ = stc_obj.generate(x, np.array(list(m), dtype=np.uint8))
+            block[coefs_ind] += y.astype(np.int16) - block[coefs_ind] % 2
+            protect[block_num, coefs_ind] = True
+            global_block = img.blockIndex(row_i, block_i)
+            hash_path += ''.join(['0', str(channel_i), str(global_block).zfill(int_format)] + [str(x).zfill(2) for x in coefs_ind] + ['0','0'])
+        if msg_i < len(msg):
+            raise Exception('Message too long!')
+        # we now have stc encoded blocks, so we must now perform the dither adjustment,
+        # over the whole image in one go, on the coefs the path points at
+        img = self.ditherAdjust(img, protect.reshape(img.coefs.shape))
+        return hash_path, img
+
+    def bitArray(self, msg):
+        # '0'/'1' message string -> uint8 array of bits
+        return np.frombuffer(msg.encode(), dtype=np.uint8) - ord('0')
+
+    def F5Hosts(self, img, blocks):
+        # nonzero AC coefs of the given global blocks in embedding order,
+        # as (global block, coef index, value) arrays
+        coefs = img.coefs.reshape((-1, self.BLOCK_SIZE*self.BLOCK_SIZE))
+        perm_i, coef_i = np.nonzero(coefs[blocks, 1:])
+        coef_i += 1
+        blocks = blocks[perm_i]
+        return blocks, coef_i, coefs[blocks, coef_i]
+
+    def F5(self, msg, img, rng=np.random, keyed=False):
+        # embeds along the nonzero AC coefs of all blocks, in a random block order.
+        # a coef with |coef| > 1 always takes the next bit and is decremented
+        # towards 0 if its lsb doesn't match. a +-1 coef only takes it if it
+        # already matches - otherwise it would shrink to 0, so it is skipped
+        # (left as it is) and the bit moves on to the next coef. which coef a
+        # bit lands on depends on every bit before it, so for each bit value
+        # the next coef able to take it is precomputed and the scan only does
+        # one lookup per bit.
+        # keyed: rng comes from the key and the recipient walks the same order
+        # without a path, so skipped coefs really are shrunk to 0 as in the
+        # original F5 - every nonzero coef it meets is then a carrier
+        num_channels = len(img)
+        msg = self.bitArray(msg)
+        block_perms = rng.permutation(np.arange(num_channels * self.ver_block_count * self.hor_block_count))
+        coefs = img.coefs.reshape((-1, self.BLOCK_SIZE*self.BLOCK_SIZE))
         path = list()
-        i, j = 0, 1
-        # random permutation of row indices
-        # generate a new permutation of blocks for each row change
+        bit_i = 0
+        # blocks are taken a chunk at a time, so the work follows the message
+        # length rather than the image size
+        for chunk_start in range(0, len(block_perms), self.F5_CHUNK):
+            if bit_i >= len(msg):
+                break
+            chunk_blocks, coef_i, hosts = self.F5Hosts(img, block_perms[chunk_start:chunk_start+self.F5_CHUNK])
+            lsbs = np.where(hosts < 0, (1 - hosts) % 2, hosts % 2)
+            big = np.abs(hosts) > 1
+
+            num_hosts = len(hosts)
+            next_host = list()
+            for bit in (0, 1):
+                usable = np.where(big | (lsbs == bit), np.arange(num_hosts), num_hosts)
+                usable = np.minimum.accumulate(usable[::-1])[::-1]
+                next_host.append(usable.tolist() + [num_hosts])
+            used = list()
+            host_i = 0
+            for bit in msg[bit_i:].tolist():
+                host_i = next_host[bit][host_i]
+                if host_i >= num_hosts:
+                    break
+                used.append(host_i)
+                host_i += 1
+            used = np.array(used, dtype=np.int64)
+            bits = msg[bit_i:bit_i+len(used)]
+            bit_i += len(used)
+
+            if keyed:
+                # the coefs passed over on the way, or all that are left
+                # if the chunk ran out before the message did
+                passed = num_hosts if bit_i < len(msg) else used[-1] + 1
+                skipped = np.ones(passed, dtype=bool)
+                skipped[used] = False
+                coefs[chunk_blocks[:passed][skipped], coef_i[:passed][skipped]] = 0
+            blocks, coef_i = chunk_blocks[used], coef_i[used]
+            change = big[used] & (lsbs[used] != bits)
+            coefs[blocks[change], coef_i[change]] -= np.sign(hosts[used][change])
+            channel_i, block = np.divmod(blocks, img.total_blocks)
+            row_i, block_i = img.blockRowCol(block)
+            path.append(np.stack([channel_i, row_i, block_i, coef_i], axis=1))
+        if bit_i < len(msg):
+            raise Exception('Message too long!')
+        if keyed:
+            return None, img
+        path = np.concatenate(path)
+        return self.formatPath(path), img
+
+    def F5Matrix(self, msg, img, k):
+        # matrix encoded F5 (1, 2^k-1, k): k bits go in a group of n = 2^k-1
+        # nonzero AC coefs with at most one change. the group's syndrome is the
+        # xor of the 1-based positions of members whose lsb is 1, and if it
+        # isn't the k message bits the member at position (syndrome ^ bits) is
+        # decremented towards 0. when that member is +-1 it would shrink to 0,
+        # so it is left as it is and swapped out of the group for a fresh coef.
+        # every group is formed and checked at once, and only the ones that hit
+        # a +-1 go round again. the last k' < k bits get a (1, 2^k'-1, k') group
+        msg = self.bitArray(msg)
+        num_channels = len(img)
         block_perms = np.random.permutation(np.arange(num_channels * self.ver_block_count * self.hor_block_count))
-        for block_num in block_perms:
-            if i >= len(msg):
-                path = self.formatPath(np.array(path))
-                return path, img
-            channel_i = block_num // (self.ver_block_count * self.hor_block_count)
-            row_i = (block_num % (self.ver_block_count * self.hor_block_count)) // self.hor_block_count
-            block_i = (block_num % (self.ver_block_count * self.hor_block_count)) % self.hor_block_count
-            channel = img[channel_i]
-            j = 1
-            while j < 64:
-                host = channel[row_i][block_i][j]
-                if host != 0.:
-                    try:
-                        msg_bit = int(msg[i])
-                    except:
-                        break
-                    #print(f"host:{host} lsb:{lsbF5(host)} bit: {msg_bit}")
-                    if self.lsbF5(host) == msg_bit:
-                        #print(msg_bit, i, "MATCH:", host)
-                        path.append(np.array([channel_i, row_i, block_i, j]))
-                        i+=1
-                    else:
-                        #print(msg_bit, i, ": NO MATCH:", host, "->", host, "-", math.copysign(1,host))
-                        host = host - math.copysign(1, host)
-                        if host != 0:
-                            channel[row_i][block_i][j] = host
-                            path.append(np.array([channel_i, row_i, block_i, j]))
-                            i+=1
-                j+=1
-        raise Exception('Message too long!')
+        coefs = img.coefs.reshape((-1, self.BLOCK_SIZE*self.BLOCK_SIZE))
+        full_groups, rest = divmod(len(msg), k)
+        weights = 1 << np.arange(k-1, -1, -1)
+        codes = [(2**k - 1, msg[:full_groups*k].reshape((-1, k)) @ weights)]
+        if rest:
+            codes.append((2**rest - 1, np.array([msg[full_groups*k:] @ weights[k-rest:]])))
+
+        # candidate coefs are pulled in a chunk of blocks at a time as needed
+        blocks, coef_i, hosts = [np.empty(0, dtype=np.int64)] * 3
+        next_block, cursor = 0, 0
+        def take(count):
+            nonlocal blocks, coef_i, hosts, next_block, cursor
+            parts, found = [(blocks, coef_i, hosts)], len(hosts)
+            while cursor + count > found:
+                if next_block >= len(block_perms):
+                    raise Exception('Message too long!')
+                parts.append(self.F5Hosts(img, block_perms[next_block:next_block+self.F5_CHUNK]))
+                found += len(parts[-1][2])
+                next_block += self.F5_CHUNK
+            if len(parts) > 1:
+                blocks, coef_i, hosts = [np.concatenate(part) for part in zip(*parts)]
+            cursor += count
+            return np.arange(cursor - count, cursor)
 
-    def LSB(self, msg, img):
-        msg_i = 0
         path = list()
+        for n, targets in codes:
+            positions = np.arange(1, n+1)
+            members = take(len(targets) * n).reshape((len(targets), n))
+            pending = np.arange(len(targets))
+            while len(pending):
+                group_hosts = hosts[members[pending]]
+                lsbs = np.where(group_hosts < 0, (1 - group_hosts) % 2, group_hosts % 2)
+                change = np.bitwise_xor.reduce(lsbs * positions, axis=1) ^ targets[pending]
+                changed = members[pending, change-1]
+                shrink = (change > 0) & (np.abs(hosts[changed]) == 1)
+                done = (change > 0) & ~shrink
+                changed = changed[done]
+                coefs[blocks[changed], coef_i[changed]] -= np.sign(hosts[changed])
+                pending, change = pending[shrink], change[shrink]
+                members[pending, change-1] = take(len(pending))
+            path.append(members.ravel())
+        path = np.concatenate(path)
+
+        channel_i, block = np.divmod(blocks[path], img.total_blocks)
+        row_i, block_i = img.blockRowCol(block)
+        path = np.stack([channel_i, row_i, block_i, coef_i[path]], axis=1)
+        return self.formatPath(path), img
+
+    def LSB(self, msg, img, rng=np.random, keyed=False):
+        # blocks are taken in raster order, channel by channel, and each one's
+        # AC coefs in a random order. every nonzero coef takes the next bit and
+        # is incremented if its parity doesn't match - except -1, which goes to
+        # -2 so no carrier becomes 0. blocks go a chunk at a time, the coef
+        # orders for a chunk coming from one argsort of random keys.
+        # keyed: rng comes from the key and the recipient rebuilds the orders
+        # itself, so no path is made
+        msg = self.bitArray(msg)
         # choosing to store in the last 10 ac coefficients to reduce artefacts
         START_COEF = 1
         END_COEF = 64
-        num_channels = img.shape[0]
-        valid_indices = np.arange(START_COEF,END_COEF)
-        block_perms = np.arange(num_channels * self.ver_block_count * self.hor_block_count)
-        for block_num in block_perms:
-            channel_i = block_num // (self.ver_block_count * self.hor_block_count)
-            row_i = (block_num % (self.ver_block_count * self.hor_block_count)) // self.hor_block_count
-            block_i = (block_num % (self.ver_block_count * self.hor_block_count)) % self.hor_block_count
-            channel = img[channel_i]
-            for coef_i in np.random.permutation(valid_indices):
-                if msg_i >= len(msg):
-                    path = self.formatPath(np.array(path))
-                    return path, img
-                bit = msg[msg_i]
-                chosen_coef = int(channel[row_i][block_i][coef_i])
-                if chosen_coef == 0:
-                    continue
-                if str(chosen_coef % 2) != bit:
-                    img[channel_i][row_i][block_i][coef_i] += 1
-                path.append(np.array([channel_i, row_i, block_i, coef_i]))
-                msg_i += 1
-        raise Exception('Message is too long!')
+        coefs = img.coefs.reshape((-1, self.BLOCK_SIZE*self.BLOCK_SIZE))
+        path = list()
+        bit_i = 0
+        for chunk_start in range(0, len(coefs), self.F5_CHUNK):
+            if bit_i >= len(msg):
+                break
+            blocks = np.arange(chunk_start, min(chunk_start + self.F5_CHUNK, len(coefs)))
+            orders = np.argsort(rng.random((len(blocks), END_COEF - START_COEF)), axis=1) + START_COEF
+            perm_i, order_i = np.nonzero(coefs[blocks[:, None], orders])
+            perm_i, order_i = perm_i[:len(msg) - bit_i], order_i[:len(msg) - bit_i]
+            block, coef_i = blocks[perm_i], orders[perm_i, order_i]
+            bits = msg[bit_i:bit_i+len(block)]
+            bit_i += len(block)
+
+            change = coefs[block, coef_i] % 2 != bits
+            changed = block[change], coef_i[change]
+            coefs[changed] += np.where(coefs[changed] == -1, -1, 1).astype(coefs.dtype)
+            channel_i, block = np.divmod(block, img.total_blocks)
+            row_i, block_i = img.blockRowCol(block)
+            path.append(np.stack([channel_i, row_i, block_i, coef_i], axis=1))
+        if bit_i < len(msg):
+            raise Exception('Message is too long!')
+        if keyed:
+            return None, img
+        path = np.concatenate(path)
+        return self.formatPath(path), img
 
     def formatPath(self, path):
+        # (n, 4) integer path of [channel, row, block, coef] -> string of fixed
+        # width decimal fields, each entry closed by '00'. every field's digits
+        # are computed as columns of one array rather than formatted per entry
+        path = np.asarray(path, dtype=np.int64).reshape((-1, 4))
         path = path+1 # so we can use 00 as an end-of-block marker
         row_format = len(str(self.ver_block_count))
         block_format = len(str(self.hor_block_count))
@@ -859,11 +795,9 @@ class encoder:
             row_format += 1
         if block_format % 2 != 0:
             block_format += 1
-        path_string = ''
-        for bit_loc in path:
-            path_string += str(bit_loc[0]).zfill(2) + str(bit_loc[1]).zfill(row_format) + str(bit_loc[2]).zfill(block_format) \
-                + str(bit_loc[3]).zfill(2) + '00'
-        return path_string
+        fields = np.concatenate((path, np.zeros((len(path), 1), dtype=np.int64)), axis=1)
+        digits = [fields[:, [i]] // 10 ** np.arange(width-1, -1, -1) % 10 for i, width in enumerate((2, row_format, block_format, 2, 2))]
+        return (np.concatenate(digits, axis=1) + ord('0')).astype(np.uint8).tobytes().decode()
 
     def hashPath(self, path, key):
         byte_path = str.encode(path)
@@ -883,40 +817,29 @@ class encoder:
 
         return 0
 
-    def encode(self, img_name, message_string, key, func=0, verbose=False, use_rs=True, output_name="stego"):
+    def writeCoefficients(self, img, file_name):
+        # write quantized zig zag coefs and our quant tables straight into a baseline
+        # jpeg, skipping the inverse pipeline and a second lossy compression
+        _, unzigzag = getZigZag(self.BLOCK_SIZE)
+        num_channels = len(img)
+        blocks = np.asarray(img, dtype=np.int16)[..., unzigzag]
+        blocks = blocks.reshape((num_channels, self.ver_block_count, self.hor_block_count, self.BLOCK_SIZE, self.BLOCK_SIZE))
+        # jpeg level shifts pixels by -128 before its DCT, ours works on 0..255,
+        # so take the offset back off DC (decoder.readCoefficients adds it back)
+        tables = self.getQuantTableStack(num_channels)
+        blocks[..., 0, 0] -= np.rint(128 * self.BLOCK_SIZE / tables[:, 0, 0]).astype(np.int16).reshape((num_channels, 1, 1))
+        qt = np.array([self.Y_quant_table, self.C_quant_table][:min(num_channels, 2)], dtype=np.uint16)
+        jpeg = jpeglib.from_dct(*np.ascontiguousarray(blocks), qt=qt)
+        jpeg.height, jpeg.width = self.img_height, self.img_width
+        jpeg.write_dct(file_name)
+
+    def encode(self, img_name, message_string, key, func=0, verbose=False, use_rs=True, output_name="stego", lossless=True, restart_interval=None, f5_k=1, path_file=True):
         img, greyscale = self.__readImage(img_name)
-        if not greyscale:
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2YCR_CB)
-
-        with open('.v_imgdim', 'wb') as fp:
-            pickle.dump((self.img_height, self.img_width), fp)
-        if self.img_width % self.BLOCK_SIZE != 0:
-            img = self.__padImageWidth(img)
-        if self.img_height % self.BLOCK_SIZE != 0:
-            img = self.__padImageHeight(img)
-        
-        new_img_height, new_img_width = self.getImageDimensions(img)
-        self.hor_block_count, self.ver_block_count = new_img_width // self.BLOCK_SIZE, new_img_height // self.BLOCK_SIZE
-        total_blocks = self.ver_block_count * self.hor_block_count
-        with open('.imgdim', 'wb') as fp:
-            pickle.dump((new_img_height, new_img_width), fp)
-
-        if not greyscale:
-            Y_img, Cr_img, Cb_img = cv2.split(img)
-            img = self.blockify([Y_img, Cb_img, Cr_img])
-            #print("Separated successfully")
-        else:
-            img = self.blockify([img])
-
-        #print("beginning dct...")
-        img = self.DCT_2(img)
-        #print("finished dct")
 
-        img = self.quantizeAndRound(img)
-        #print("finished quantization and round")
-
-        img = self.zigZagEncode(img)
-        #print("finished zigzag")
+        # the cover is only held as 8-bit pixels, everything after that is done
+        # a stripe at a time and kept as int16 coefficients
+        img = self.transformStripes(img, greyscale)
+        self.ver_block_count, self.hor_block_count = img.ver_block_count, img.hor_block_count
 
         #print("encoding message...")
         bin_msg = self.messageConv(message_string)
@@ -927,8 +850,21 @@ class encoder:
             for message_poly in message_polys:
                 bin_poly = [format(num, '08b') for num in np.array(message_poly, dtype=np.uint8)]
                 bin_msg += ''.join([bit for bit in bin_poly])
-        if func == 0:
-            hash_path, img = self.F5(bin_msg, img)
+        rng = np.random
+        if not path_file:
+            # the embedding order comes from the key and the recipient rebuilds
+            # it, which only works where the carriers can be found again
+            if func not in (0, 3) or f5_k > 1:
+                raise ValueError('Only F5 and LSB can embed without a path file')
+            rng = keyedGenerator(key)
+            bin_msg = lengthPrefix(len(bin_msg)) + bin_msg
+
+        if func == 0 and f5_k > 1:
+            # matrix encoding, f5_k bits per 2^f5_k-1 coefs
+            hash_path, img = self.F5Matrix(bin_msg, img, f5_k)
+
+        elif func == 0:
+            hash_path, img = self.F5(bin_msg, img, rng, not path_file)
 
         elif func == 1:
             hash_path, img = self.sdcsF5(bin_msg, img)
@@ -937,44 +873,41 @@ class encoder:
             hash_path, img = self.optimDMCSS(bin_msg, img)
         
         elif func == 3:
-            hash_path, img = self.LSB(bin_msg, img)
+            hash_path, img = self.LSB(bin_msg, img, rng, not path_file)
+
+        elif func == 4:
+            hash_path, img = self.drF5(bin_msg, img)
         
         else:
-            raise ValueError('Algorithm must be:\n0: F5\n1: SDCS F5\n2: drF5')
-        self.hashPath(hash_path,key)
+            raise ValueError('Algorithm must be:\n0: F5\n1: SDCS F5\n2: optimDMCSS\n3: LSB\n4: drF5')
+        if path_file:
+            self.hashPath(hash_path,key)
         #print("encoded and written path to file")
 
         if verbose:
-            # verbose mode outputs jpeg as txt and completes all encoding steps
-            img = self.RLEandDPCM(img)
+            # verbose mode completes all encoding steps itself and writes the
+            # entropy coded stream, dimensions and tables to a binary container
+            num_channels = len(img)
+            img = self.RLEandDPCM(img.grid(), restart_interval)
             print("finished rle")
 
-            bitstring = self.huffman(img)
-            final_file = open(output_name+".txt", "w")
-            final_file.write(bitstring)
-            final_file.close()
+            bitstream, segment_starts = self.huffman(img, restart_interval)
+            quant_tables = self.getQuantTableStack(min(num_channels, 2))
+            writeContainer(output_name+".sf5", bitstream, (self.img_height, self.img_width), quant_tables, num_channels, restart_interval, segment_starts)
             print("done!")
         
+        elif lossless:
+            # write the modified coefs and tables directly - they reach the file exactly
+            self.writeCoefficients(img, output_name+".jpg")
+
         else:
             from decoder import decoder
-            decoder_obj = decoder(self.BLOCK_SIZE, self.RS_PARAM)
+            decoder_obj = decoder(self.BLOCK_SIZE, self.RS_PARAM, self.PRECISION, self.STRIPE_ROWS)
             decoder_obj.defineBlockCount(self.ver_block_count, self.hor_block_count)
-            img = [channel.reshape((total_blocks, self.BLOCK_SIZE*self.BLOCK_SIZE)) for channel in img]
-            img = decoder_obj.unZigZag(img)
-            img = decoder_obj.deQuantize(img)
-            img = decoder_obj.DCT_3(img)
-            if not greyscale:
-                img = np.clip(decoder_obj.YCbCr2BGR(img), 0,255)
-            else:
-                img = np.clip(img, 0, 255)[0]
-            img = decoder_obj.assembleImage(img)
-            if self.img_height != new_img_height:
-                img = decoder_obj.removeVPadding(img, new_img_height)
-            if self.img_width != new_img_width:
-                img = decoder_obj.removeHPadding(img, new_img_width)
+            img = decoder_obj.renderStripes(img, self.img_height, self.img_width, greyscale)
             #cv2.imwrite(output_name+".jpg", img, [int(cv2.IMWRITE_JPEG_QUALITY), 100])
             if not greyscale:
-                jpeg_bytes = simplejpeg.encode_jpeg(img.astype(np.uint8), 100, 'BGR', '444', False)
+                jpeg_bytes = simplejpeg.encode_jpeg(img, 100, 'BGR', '444', False)
                 with open(output_name+".jpg", "wb") as f:
                     f.write(jpeg_bytes)
             else:
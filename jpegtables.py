@@ -0,0 +1,258 @@
+import numpy as np
+from functools import lru_cache
+from types import MappingProxyType
+
+from bitstream import buildLookup
+
+# Constant tables shared by the encoder and decoder.
+# These are built once per process and handed out read-only,
+# so every instance can index with them without copying.
+# Arrays have their write flag cleared and dicts are wrapped in
+# MappingProxyType - anything that needs to change one takes a copy.
+
+@lru_cache(maxsize=None)
+def getZigZag(block_size):
+    # zigzag[i] is the raster index of the i-th coefficient in zig zag order
+    # and unzigzag is the inverse permutation, so for a flattened block
+    # block[zigzag] is the zig zag array and zz_block[unzigzag] undoes it
+    id_block = np.arange(block_size*block_size).reshape((block_size, block_size))
+    zigzag = np.hstack([np.diagonal(id_block[::-1,:], k)[::(2*(k % 2)-1)] for k in range(1-block_size, block_size)])
+    unzigzag = np.argsort(zigzag)
+    zigzag.setflags(write=False)
+    unzigzag.setflags(write=False)
+    return zigzag, unzigzag
+
+# the standard jpeg block size is built at import
+ZIGZAG, UNZIGZAG = getZigZag(8)
+
+def freeze(arr):
+    arr = np.asarray(arr)
+    arr.setflags(write=False)
+    return arr
+
+# quantization tables from the jpeg standard (quality 50)
+_Y_quant_table = np.array([
+    [16, 11, 10, 16, 24, 40, 51, 61],
+    [12, 12, 14, 19, 26, 58, 60, 55],
+    [14, 13, 16, 24, 40, 57, 69, 56],
+    [14, 17, 22, 29, 51, 87, 80, 62],
+    [18, 22, 37, 56, 68, 109, 103, 77],
+    [24, 36, 55, 64, 81, 104, 113, 92],
+    [49, 64, 78, 87, 103, 121, 120, 101],
+    [72, 92, 95, 98, 112, 100, 103, 99]])
+
+_C_quant_table = np.array([
+    [17, 18, 24, 47, 99, 99, 99, 99],
+    [18, 21, 26, 66, 99, 99, 99, 99],
+    [24, 26, 56, 99, 99, 99, 99, 99],
+    [47, 66, 99, 99, 99, 99, 99, 99],
+    [99, 99, 99, 99, 99, 99, 99, 99],
+    [99, 99, 99, 99, 99, 99, 99, 99],
+    [99, 99, 99, 99, 99, 99, 99, 99],
+    [99, 99, 99, 99, 99, 99, 99, 99]])
+
+Y_QUANT_TABLE, C_QUANT_TABLE = freeze(_Y_quant_table), freeze(_C_quant_table)
+
+# Huffman tables for DC and AC values
+# yes they are massive, I think this is probably
+# the fastest and most sensible way to implement them
+# considering I have to pull the inverse too.
+_dc_codeword_dict = {
+    0: '00',
+    1: '010',
+    2: '011',
+    3: '100',
+    4: '101',
+    5: '110',
+    6: '1110',
+    7: '11110',
+    8: '111110',
+    9: '1111110',
+    10: '11111110',
+    11: '111111110'
+}
+
+_ac_codeword_dict = {
+    (0,0): '1010',
+    (0,1): '00',
+    (0,2): '01',
+    (0,3): '100',
+    (0,4): '1011',
+    (0,5): '11010',
+    (0,6): '1111000',
+    (0,7): '11111000',
+    (0,8): '1111110110',
+    (0,9): '1111111110000010',
+    (0,10): '1111111110000011',
+    (1,1): '1100',
+    (1,2): '11011',
+    (1,3): '1111001',
+    (1,4): '111110110',
+    (1,5): '11111110110',
+    (1,6): '1111111110000100',
+    (1,7): '1111111110000101',
+    (1,8): '1111111110000110',
+    (1,9): '1111111110000111',
+    (1,10): '1111111110001000',
+    (2,1): '11100',
+    (2,2): '11111001',
+    (2,3): '1111110111',
+    (2,4): '111111110100',
+    (2,5): '1111111110001001',
+    (2,6): '1111111110001010',
+    (2,7): '1111111110001011',
+    (2,8): '1111111110001100',
+    (2,9): '1111111110001101',
+    (2,10): '1111111110001110',
+    (3,1): '111010',
+    (3,2): '111110111',
+    (3,3): '111111110101',
+    (3,4): '1111111110001111',
+    (3,5): '1111111110010000',
+    (3,6): '1111111110010001',
+    (3,7): '1111111110010010',
+    (3,8): '1111111110010011',
+    (3,9): '1111111110010100',
+    (3,10): '1111111110010101',
+    (4,1): '111011',
+    (4,2): '1111111000',
+    (4,3): '1111111110010110',
+    (4,4): '1111111110010111',
+    (4,5): '1111111110011000',
+    (4,6): '1111111110011001',
+    (4,7): '1111111110011010',
+    (4,8): '1111111110011011',
+    (4,9): '1111111110011100',
+    (4,10): '1111111110011101',
+    (5,1): '1111010',
+    (5,2): '11111110111',
+    (5,3): '1111111110011110',
+    (5,4): '1111111110011111',
+    (5,5): '1111111110100000',
+    (5,6): '1111111110100001',
+    (5,7): '1111111110100010',
+    (5,8): '1111111110100011',
+    (5,9): '1111111110100100',
+    (5,10): '1111111110100101',
+    (6,1): '1111011',
+    (6,2): '111111110110',
+    (6,3): '1111111110100110',
+    (6,4): '1111111110100111',
+    (6,5): '1111111110101000',
+    (6,6): '1111111110101001',
+    (6,7): '1111111110101010',
+    (6,8): '1111111110101011',
+    (6,9): '1111111110101100',
+    (6,10): '1111111110101101',
+    (7,1): '11111010',
+    (7,2): '111111110111',
+    (7,3): '1111111110101110',
+    (7,4): '1111111110101111',
+    (7,5): '1111111110110000',
+    (7,6): '1111111110110001',
+    (7,7): '1111111110110010',
+    (7,8): '1111111110110011',
+    (7,9): '1111111110110100',
+    (7,10): '1111111110110101',
+    (8,1): '111111000',
+    (8,2): '111111111000000',
+    (8,3): '1111111110110110',
+    (8,4): '1111111110110111',
+    (8,5): '1111111110111000',
+    (8,6): '1111111110111001',
+    (8,7): '1111111110111010',
+    (8,8): '1111111110111011',
+    (8,9): '1111111110111100',
+    (8,10): '1111111110111101',
+    (9,1): '111111001',
+    (9,2): '1111111110111110',
+    (9,3): '1111111110111111',
+    (9,4): '1111111111000000',
+    (9,5): '1111111111000001',
+    (9,6): '1111111111000010',
+    (9,7): '1111111111000011',
+    (9,8): '1111111111000100',
+    (9,9): '1111111111000101',
+    (9,10): '1111111111000110',
+    (10,1): '111111010',
+    (10,2): '1111111111000111',
+    (10,3): '1111111111001000',
+    (10,4): '1111111111001001',
+    (10,5): '1111111111001010',
+    (10,6): '1111111111001011',
+    (10,7): '1111111111001100',
+    (10,8): '1111111111001101',
+    (10,9): '1111111111001110',
+    (10,10): '1111111111001111',
+    (11,1): '1111111001',
+    (11,2): '1111111111010000',
+    (11,3): '1111111111010001',
+    (11,4): '1111111111010010',
+    (11,5): '1111111111010011',
+    (11,6): '1111111111010100',
+    (11,7): '1111111111010101',
+    (11,8): '1111111111010110',
+    (11,9): '1111111111010111',
+    (11,10): '1111111111011000',
+    (12,1): '1111111010',
+    (12,2): '1111111111011001',
+    (12,3): '1111111111011010',
+    (12,4): '1111111111011011',
+    (12,5): '1111111111011100',
+    (12,6): '1111111111011101',
+    (12,7): '1111111111011110',
+    (12,8): '1111111111011111',
+    (12,9): '1111111111100000',
+    (12,10): '1111111111100001',
+    (13,1): '11111111000',
+    (13,2): '1111111111100010',
+    (13,3): '1111111111100011',
+    (13,4): '1111111111100100',
+    (13,5): '1111111111100101',
+    (13,6): '1111111111100110',
+    (13,7): '1111111111100111',
+    (13,8): '1111111111101000',
+    (13,9): '1111111111101001',
+    (13,10): '1111111111101010',
+    (14,1): '1111111111101011',
+    (14,2): '1111111111101100',
+    (14,3): '1111111111101101',
+    (14,4): '1111111111101110',
+    (14,5): '1111111111101111',
+    (14,6): '1111111111110000',
+    (14,7): '1111111111110001',
+    (14,8): '1111111111110010',
+    (14,9): '1111111111110011',
+    (14,10): '1111111111110100',
+    (15,1): '1111111111110101',
+    (15,2): '1111111111110110',
+    (15,3): '1111111111110111',
+    (15,4): '1111111111111000',
+    (15,5): '1111111111111001',
+    (15,6): '1111111111111010',
+    (15,7): '1111111111111011',
+    (15,8): '1111111111111100',
+    (15,9): '1111111111111101',
+    (15,10): '1111111111111110',
+    (15,0): '11111111001'
+}
+
+DC_CODEWORDS = MappingProxyType(_dc_codeword_dict)
+DC_CODEWORDS_INV = MappingProxyType({codeword: cat for cat, codeword in _dc_codeword_dict.items()})
+AC_CODEWORDS = MappingProxyType(_ac_codeword_dict)
+AC_CODEWORDS_INV = MappingProxyType({codeword: cat for cat, codeword in _ac_codeword_dict.items()})
+
+def getHuffmanTable(codeword_dict, shape):
+    # integer (code, length) arrays indexed by category, or by (skip, category)
+    # for AC, built from the codeword strings above
+    codes, lengths = np.zeros(shape, dtype=np.int64), np.zeros(shape, dtype=np.int64)
+    for symbol, codeword in codeword_dict.items():
+        codes[symbol], lengths[symbol] = int(codeword, 2), len(codeword)
+    return freeze(codes), freeze(lengths)
+
+# encoding side: (code, length) per symbol
+DC_HUFF_CODES, DC_HUFF_LENGTHS = getHuffmanTable(DC_CODEWORDS, (12,))
+AC_HUFF_CODES, AC_HUFF_LENGTHS = getHuffmanTable(AC_CODEWORDS, (16, 11))
+
+# decoding side: peek tables for bitstream.bitreader
+DC_LOOKUP, AC_LOOKUP = buildLookup(DC_CODEWORDS), buildLookup(AC_CODEWORDS)
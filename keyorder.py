@@ -0,0 +1,28 @@
+import hashlib
+import numpy as np
+
+# Embedding order derived from the secret key, so the recipient can work out
+# which coefs carry the message from the key alone rather than a path file.
+# The key is stretched with PBKDF2 into the seed of a PCG64 generator. Every
+# call builds its own generator, so nothing goes through numpy's global
+# random state and concurrent encodes/decodes don't disturb each other.
+
+KDF_SALT = b'stegano-f5 embedding order'
+KDF_ROUNDS = 100000
+# bits in front of the message holding its length, as the recipient has no
+# path to tell where it ends
+LENGTH_BITS = 32
+# blocks the decoder reads per step while rebuilding the order
+ORDER_CHUNK = 4096
+
+def keyedGenerator(key):
+    if isinstance(key, str):
+        key = key.encode()
+    seed = hashlib.pbkdf2_hmac('sha256', key, KDF_SALT, KDF_ROUNDS)
+    return np.random.Generator(np.random.PCG64(int.from_bytes(seed, 'big')))
+
+def lengthPrefix(num_bits):
+    # '0'/'1' string of the message length for the front of a keyed message
+    if num_bits >= 1 << LENGTH_BITS:
+        raise ValueError('Message too long!')
+    return format(num_bits, '0' + str(LENGTH_BITS) + 'b')
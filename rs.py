@@ -346,7 +346,8 @@ class rs:
         message = [bitstring[i:i+block_size] for i in range(0, blocks, block_size)]
         message = [int(i, 2) for i in message]
         messages = [message[i:i+self.K] for i in range(0, len(message), self.K)]
-        return np.array([self.encodeMsg(message) for message in messages])
+        # the last codeword can be shorter, so this stays a list
+        return [self.encodeMsg(message) for message in messages]
 
     def getLocPoly(self, R_x, err_locs):
         #convert error locations to right-to-left indices
@@ -375,6 +376,7 @@ class rs:
             err_poly = self.getErrPoly(syndromes, loc_poly)
             errors = self.findErrors(loc_poly, err_poly)
             return self.fixErrors(R_x, errors)
+        return R_x
 
 #rs_obj = rs(256)
 #m = [1,2,3,4,5,6,7,8,9,10,11]
@@ -1,5 +1,9 @@
 # https://stackoverflow.com/questions/7186518/function-with-varying-number-of-for-loops-python
 
+import itertools
+import os.path
+import pickle
+import tempfile
 import numpy as np
 
 class sdcs:
@@ -8,77 +12,69 @@ class sdcs:
         self.A = A
         self.s = [-1, 0, 1]
         self.z_M = [i for i in range(self.M)]
-        self.table = {i: list() for i in self.z_M}
-        self.gen_table()
-    
-    def loop_rec(self, val_dict, n):
-        if n >= 1:
-            for i_val in self.s:
-                for i in self.A:
-                    val_dict[n] = [i_val, i]
-                    self.loop_rec(val_dict, n - 1)
+        # table[d] is the change vector with the fewest nonzero entries that
+        # moves the weighted sum by d, for every residue d of Z_M. it only
+        # depends on the parameters, so it's built once and kept on disk next
+        # to this module, where the shipped one is found whatever directory
+        # the process runs from
+        table_dir = os.path.dirname(os.path.abspath(__file__))
+        self.table_name = os.path.join(table_dir, '.SDCS_' + '_'.join(str(x) for x in (self.n, self.k, self.M)) + '_' + '-'.join(str(a) for a in self.A))
+        if os.path.isfile(self.table_name):
+            with open(self.table_name, 'rb') as fp:
+                self.table = pickle.load(fp)
         else:
-            for j_val in self.s:
-                for j in self.A:
-                    val_dict[n] = [j_val, j]
-                    if j > val_dict[n+1][1]:
-                        sum = 0
-                        for _, iter_var in val_dict.items():
-                            sum = self.add(sum, self.prod(iter_var[0], iter_var[1]))
-                        new_entry = [item[1][0] for item in val_dict.items()][::-1]
-                        if new_entry not in self.table[sum]:
-                            # we do this to avoid duplicates
-                            self.table[sum].append(new_entry)
-                        # need to reverse as the iterables are stored reversed compared to if these were normal nested for loops
+            self.table = self.gen_table()
+            # written under a temporary name and moved into place, so another
+            # process never loads a half written table. if the directory isn't
+            # writable the table just isn't kept
+            try:
+                fd, tmp_name = tempfile.mkstemp(dir=table_dir, prefix=os.path.basename(self.table_name) + '.')
+            except OSError:
+                return
+            try:
+                with os.fdopen(fd, 'wb') as fp:
+                    pickle.dump(self.table, fp)
+                os.replace(tmp_name, self.table_name)
+            except OSError:
+                os.remove(tmp_name)
 
     def gen_table(self):
-        # perform n iterations of the nested for loops required to generate the values
-        val_dict = {n: list() for n in range(self.n)}
-        self.loop_rec(val_dict, self.n-1)
-        # having generated all possible combinations, remove invalid ones
-        # e.g, k limit for non-zero s values
-        for i in self.table:
-            for s_pair in self.table[i].copy():
-                zero_count = np.count_nonzero(s_pair==0)
-                if len(s_pair) - zero_count > self.k:
-                    self.table[i] = np.delete(self.table[i], np.argwhere(self.table), axis=0)
-            
+        # every sign vector over the n coefs with at most k changes, fewest
+        # changes first so each residue keeps the cheapest one that reaches it
+        deltas = np.array(list(itertools.product(self.s, repeat=self.n)), dtype=np.int8)
+        changes = np.count_nonzero(deltas, axis=1)
+        deltas = deltas[changes <= self.k]
+        deltas = deltas[np.argsort(np.count_nonzero(deltas, axis=1), kind='stable')]
+        residues = (deltas.astype(np.int64) @ np.asarray(self.A, dtype=np.int64)) % self.M
+        covered, first = np.unique(residues, return_index=True)
+        if len(covered) < self.M:
+            missing = sorted(set(self.z_M) - set(covered.tolist()))
+            raise ValueError(f'A does not cover Z_{self.M} with at most {self.k} changes, missing {missing}')
+        return deltas[first]
+
     def add(self, num1, num2):
         # addition within finite field
         return (num1 + num2) % self.M
-    
+
     def prod(self, num1, num2):
         # multiplication within finite field
         return (num1 * num2) % self.M
 
     def extract(self, sequence):
-        # sum = a0.x0 + a1.x1 + ... + an.xn
-        if len(sequence) > self.n:
+        # sum = a0.x0 + a1.x1 + ... + an.xn, for one sequence or for the
+        # last axis of an array of them
+        sequence = np.asarray(sequence, dtype=np.int64)
+        if sequence.shape[-1] > self.n:
             raise ValueError('Sequence too long')
-        else:
-            sum = 0
-            for i in range(self.n):
-                sum = self.add(sum, self.prod(self.A[i], sequence[i]))
-            return sum % self.M
-    
+        return (sequence @ np.asarray(self.A, dtype=np.int64)) % self.M
+
     def embed(self, x, b):
         # we are solving the equation a0.x0 + a0.s0 + a1.x1 + a1.s1 + ... + an.xn + an.sn = b
-        ext_x = self.extract(x)
-        desired = self.add(b, -ext_x)
-        delta = self.table[desired]
-        if len(delta) == 1:
-            return delta[0]
-        else:
-            # try to return without -1 as it requires less bit changes
-            solns = list()
-            for d in delta:
-                xd_sum = [self.add(d[i], x[i]) for i in range(len(x))]
-                if self.extract(xd_sum) == b:
-                    solns.append(d)
-            solns = np.array(solns)
-            # now try to find the one with the least changes - sort by zero entries and return last
-            return solns[(solns == 0).sum(axis=1).argsort()][-1]
-                
+        # by looking up the change vector for the residue still missing. works
+        # on one host or on an array of hosts and values at once
+        desired = self.add(np.asarray(b, dtype=np.int64), -self.extract(x))
+        return self.table[desired]
+
 def embedMsg(host, msg, sdcs):
     if len(host) != sdcs.n:
         raise Exception(f'Host array should be length n, where n specified by SDCS params: {sdcs.n}')
@@ -94,4 +90,4 @@ def embedMsg(host, msg, sdcs):
                 return [host[i] + delta[i] for i in range(len(delta))]
 
 #test = sdcs((3, 2, 17), [1,2,6])
-#print(test.embed([1,0,1], 14))
\ No newline at end of file
+#print(test.embed([1,0,1], 14))
@@ -31,6 +31,7 @@ class stc:
                         H[i+mini_row][j:j+j_step] = H_hat_bin[mini_row]
                     except:
                         return H
+        return H
 
     def backward_viterbi(self, msg, weights, path, x_index, m_index):
         # http://dde.binghamton.edu/filler/pdf/Fill10spie-syndrome-trellis-codes.pdf